@@ -0,0 +1,58 @@
+"""history_keyset_index
+
+Revision ID: 3f1b9d2c8a41
+Revises: 7c562e7ab406
+Create Date: 2026-10-18 09:12:40.512734
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f1b9d2c8a41"
+down_revision = "7c562e7ab406"
+branch_labels = None
+depends_on = None
+
+
+INDEX_NAME = "ix__message_history__user_id_assistant_send_at_id"
+
+
+def upgrade() -> None:
+    # CONCURRENTLY can not run inside a transaction and does not block writes
+    with op.get_context().autocommit_block():
+        op.create_index(
+            INDEX_NAME,
+            "message_history",
+            ["user_id", sa.text("assistant_send_at DESC"), sa.text("id DESC")],
+            unique=False,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # the composite index serves every lookup by `user_id`
+        op.drop_index(
+            op.f("ix_message_history_user_id"),
+            table_name="message_history",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_message_history_user_id"),
+            "message_history",
+            ["user_id"],
+            unique=False,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.drop_index(
+            INDEX_NAME,
+            table_name="message_history",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
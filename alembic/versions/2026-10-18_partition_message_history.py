@@ -0,0 +1,144 @@
+"""partition_message_history
+
+Revision ID: 8d4e2a7b5c13
+Revises: 3f1b9d2c8a41
+Create Date: 2026-10-18 10:02:11.904126
+
+Converts `message_history` to a table range-partitioned by month of
+`assistant_send_at`. Rows are copied in the migration transaction, so
+writes to the table wait until it is done. Partitions for the following
+months are created by `python -m src.repo.history_partitions`.
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "8d4e2a7b5c13"
+down_revision = "3f1b9d2c8a41"
+branch_labels = None
+depends_on = None
+
+
+INDEX_NAME = "ix__message_history__user_id_assistant_send_at_id"
+MONTHS_AHEAD = 3
+
+
+def _rename_primary_key(table: str, name: str) -> None:
+    op.execute(
+        f"""
+        DO $$
+        DECLARE pk text;
+        BEGIN
+            SELECT conname INTO pk FROM pg_constraint
+            WHERE conrelid = '{table}'::regclass AND contype = 'p';
+            EXECUTE format('ALTER TABLE {table} RENAME CONSTRAINT %I TO {name}', pk);
+        END $$
+        """
+    )
+
+
+def upgrade() -> None:
+    op.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+    op.execute("DROP INDEX IF EXISTS ix_message_history_user_id")
+    op.execute("ALTER TABLE message_history RENAME TO message_history_unpartitioned")
+    _rename_primary_key(
+        "message_history_unpartitioned", "message_history_unpartitioned_pkey"
+    )
+    # the sequence would be dropped with the old table
+    op.execute("ALTER SEQUENCE message_history_id_seq OWNED BY NONE")
+
+    # the partition key has to be a part of the primary key
+    op.execute(
+        """
+        CREATE TABLE message_history (
+            id INTEGER NOT NULL DEFAULT nextval('message_history_id_seq'),
+            user_id VARCHAR NOT NULL,
+            user_text VARCHAR NOT NULL,
+            assistant_text VARCHAR NOT NULL,
+            assistant_send_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            CONSTRAINT pk__message_history PRIMARY KEY (id, assistant_send_at)
+        ) PARTITION BY RANGE (assistant_send_at)
+        """
+    )
+    op.execute("ALTER SEQUENCE message_history_id_seq OWNED BY message_history.id")
+    op.execute(
+        f"CREATE INDEX {INDEX_NAME} ON message_history "
+        "(user_id, assistant_send_at DESC, id DESC)"
+    )
+    # rows outside of the monthly partitions, normally empty
+    op.execute(
+        "CREATE TABLE message_history_default PARTITION OF message_history DEFAULT"
+    )
+    op.execute(
+        f"""
+        DO $$
+        DECLARE
+            month_start timestamp;
+            last_month timestamp;
+        BEGIN
+            SELECT date_trunc(
+                'month', coalesce(min(assistant_send_at), now()) AT TIME ZONE 'UTC'
+            )
+            INTO month_start FROM message_history_unpartitioned;
+            last_month := date_trunc('month', now() AT TIME ZONE 'UTC')
+                + interval '{MONTHS_AHEAD} months';
+            WHILE month_start <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF message_history '
+                    'FOR VALUES FROM (%L) TO (%L)',
+                    'message_history_p' || to_char(month_start, 'YYYY_MM'),
+                    month_start AT TIME ZONE 'UTC',
+                    (month_start + interval '1 month') AT TIME ZONE 'UTC'
+                );
+                month_start := month_start + interval '1 month';
+            END LOOP;
+        END $$
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO message_history
+            (id, user_id, user_text, assistant_text, assistant_send_at)
+        SELECT id, user_id, user_text, assistant_text, assistant_send_at
+        FROM message_history_unpartitioned
+        """
+    )
+    op.execute("DROP TABLE message_history_unpartitioned")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE message_history RENAME TO message_history_partitioned")
+    op.execute("ALTER SEQUENCE message_history_id_seq OWNED BY NONE")
+    op.execute(f"ALTER INDEX {INDEX_NAME} RENAME TO {INDEX_NAME}_partitioned")
+    _rename_primary_key(
+        "message_history_partitioned", "message_history_partitioned_pkey"
+    )
+    op.execute(
+        """
+        CREATE TABLE message_history (
+            id INTEGER NOT NULL DEFAULT nextval('message_history_id_seq'),
+            user_id VARCHAR NOT NULL,
+            user_text VARCHAR NOT NULL,
+            assistant_text VARCHAR NOT NULL,
+            assistant_send_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            CONSTRAINT message_history_pkey PRIMARY KEY (id)
+        )
+        """
+    )
+    op.execute("ALTER SEQUENCE message_history_id_seq OWNED BY message_history.id")
+    op.execute(
+        """
+        INSERT INTO message_history
+            (id, user_id, user_text, assistant_text, assistant_send_at)
+        SELECT id, user_id, user_text, assistant_text, assistant_send_at
+        FROM message_history_partitioned
+        """
+    )
+    op.execute(
+        f"CREATE INDEX {INDEX_NAME} ON message_history "
+        "(user_id, assistant_send_at DESC, id DESC)"
+    )
+    # drops the partitions too
+    op.execute("DROP TABLE message_history_partitioned")
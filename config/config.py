@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings
 from pydantic import Field
 
@@ -15,14 +17,252 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = Field(description="pg db name")
     POSTGRES_USER: str = Field(description="pg user name")
     POSTGRES_PASSWORD: str = Field(description="pg user password")
+    POOL_SIZING: Literal["fixed", "budget"] = Field(
+        default="fixed",
+        description="fixed: pool sizes from settings, "
+        "budget: connection budgets split between the workers",
+    )
+    WEB_CONCURRENCY: int = Field(
+        default=1, description="Worker processes, exported by gunicorn_conf"
+    )
+    DB_POOL_SIZE: int = Field(default=32, description="Primary pool size (fixed)")
+    DB_MAX_OVERFLOW: int = Field(default=5, description="Primary pool overflow (fixed)")
+    DB_POOL_TIMEOUT: float = Field(
+        default=10.0, description="Seconds to wait for a free DB connection"
+    )
+    DB_CONNECTION_BUDGET: int = Field(
+        default=100,
+        description="Connections to each DB server for all workers (budget)",
+    )
+    DB_STATEMENT_CACHE_SIZE: int = Field(
+        default=500, description="asyncpg prepared statements cached per connection"
+    )
+    DB_READ_REPLICA_URLS: list[str] = Field(
+        default=[],
+        description="SQLAlchemy URLs of read replicas (postgresql+asyncpg://...)",
+    )
+    DB_READ_BALANCING: Literal["round_robin", "least_connections"] = Field(
+        default="round_robin", description="How reads are spread over replicas"
+    )
+    DB_READ_POOL_SIZE: int = Field(default=16, description="Pool size per replica")
+    DB_READ_MAX_OVERFLOW: int = Field(
+        default=5, description="Pool overflow per replica"
+    )
+    DB_REPLICA_MAX_LAG: float = Field(
+        default=10.0, description="Replicas lagging more seconds are not read"
+    )
+    DB_REPLICA_CHECK_INTERVAL: float = Field(
+        default=5.0, description="Seconds between replica health checks"
+    )
 
     REDIS_URL: str = Field(description="Redis URL")
+    REDIS_MAX_CONNECTIONS: int = Field(
+        default=5, description="Connections per Redis pool (fixed)"
+    )
+    REDIS_POOL_TIMEOUT: float = Field(
+        default=5.0, description="Seconds to wait for a free Redis connection"
+    )
+    REDIS_CONNECTION_BUDGET: int = Field(
+        default=50, description="Redis connections for all workers (budget)"
+    )
+
+    CACHE_MAXSIZE: int = Field(default=10_000, description="Max cached histories")
+    CACHE_MAX_BYTES: int = Field(
+        default=256 * 1024 * 1024, description="Max encoded size of cached histories"
+    )
+    CACHE_MAX_AGE: int = Field(default=60 * 5, description="Cached history TTL, sec")
+    CACHE_STREAM_MAXLEN: int = Field(
+        default=1000,
+        description="Approximate length of the cache sync stream. In `push` "
+        "replication an entry carries a whole encoded history, so the stream "
+        "takes up to MAXLEN * HISTORY_BUFFER_SIZE * CACHE_SHARED_TURN_BYTES of "
+        "Redis memory; pods that fall behind it resync their cached keys",
+    )
+    CACHE_REPLICATION: Literal["push", "invalidate"] = Field(
+        default="push",
+        description="Send whole values or only invalidations through the cache stream",
+    )
+    CACHE_WARMUP_KEYS: int = Field(
+        default=1000, description="Recently written keys loaded at start, 0 disables"
+    )
+    CACHE_SHARED_MEMORY: bool = Field(
+        default=False, description="Share cached histories between workers of a host"
+    )
+    CACHE_SHARED_PATH: str = Field(
+        default="/dev/shm/estatebot_cache", description="Shared memory cache file"
+    )
+    CACHE_SHARED_SLOTS: int | None = Field(
+        default=None,
+        description="Number of slots in the shared memory cache, as many as "
+        "CACHE_MAX_BYTES holds (at most CACHE_MAXSIZE) if not set. The whole "
+        "file is allocated at start and has to fit in /dev/shm",
+    )
+    CACHE_SHARED_SLOT_SIZE: int | None = Field(
+        default=None,
+        description="Max size of one shared memory cache entry, "
+        "HISTORY_BUFFER_SIZE * CACHE_SHARED_TURN_BYTES if not set",
+    )
+    CACHE_SHARED_TURN_BYTES: int = Field(
+        default=4096, description="Encoded size of one chat turn to reserve"
+    )
+    HISTORY_BUFFER_SIZE: int = Field(
+        default=50, description="Chat turns kept per user in the history cache"
+    )
+    CHAT_CONTEXT_WINDOW: int = Field(
+        default=5, description="User messages prepended to the question for intent/NER"
+    )
+    CHAT_CONTEXT_MAX_CHARS: int = Field(
+        default=2000, description="Max length of the history prepended to the question"
+    )
+    HISTORY_APPEND_UPDATES: bool = Field(
+        default=False,
+        description=(
+            "Keep histories as capped Redis lists and replicate only new turns, "
+            "all pods must use the same value"
+        ),
+    )
+    HISTORY_FLUSH_INTERVAL: float = Field(
+        default=60, description="Max seconds chat turns wait before the DB insert"
+    )
+    HISTORY_FLUSH_SIZE: int = Field(
+        default=500, description="Buffered chat turns that trigger an early DB insert"
+    )
+    HISTORY_SPOOL_DIR: str | None = Field(
+        default=None,
+        description="Directory for the crash-safe spool of unsaved chat turns",
+    )
+    HISTORY_SPOOL_FSYNC_INTERVAL: float = Field(
+        default=0.05, description="Seconds between group fsyncs of the history spool"
+    )
+    HISTORY_QUEUE_CAPACITY: int = Field(
+        default=20000, description="Max chat turns kept in memory until saved"
+    )
+    HISTORY_QUEUE_OVERFLOW: Literal["block", "drop_oldest", "spill"] = Field(
+        default="block",
+        description="What a full history queue does, `spill` needs "
+        "HISTORY_SPOOL_DIR. Rows dropped by `drop_oldest` stay in the spool and "
+        "are written after a crash",
+    )
+    HISTORY_QUEUE_BLOCK_TIMEOUT: float = Field(
+        default=1.0, description="Seconds `block` waits for room before dropping"
+    )
+    HISTORY_FLUSH_CHUNK_SIZE: int = Field(
+        default=1000, description="Rows per history INSERT transaction"
+    )
+    HISTORY_RETRY_BASE_DELAY: float = Field(
+        default=1.0, description="First retry delay of a failed history flush"
+    )
+    HISTORY_RETRY_MAX_DELAY: float = Field(
+        default=60.0, description="Max retry delay of a failed history flush"
+    )
+    HISTORY_DEAD_LETTER_PATH: str | None = Field(
+        default=None, description="JSON lines file for chat turns the DB rejects"
+    )
+    HISTORY_PARTITIONS_AHEAD: int = Field(
+        default=3, description="Monthly message_history partitions created ahead"
+    )
+    HISTORY_RETENTION_MONTHS: int | None = Field(
+        default=None,
+        description="Months of message_history kept in the DB, older are archived",
+    )
+    HISTORY_ARCHIVE_DIR: str = Field(
+        default="archive/message_history",
+        description="Directory for archived message_history partitions",
+    )
+    HISTORY_RECENT_DAYS: int | None = Field(
+        default=None,
+        description="Only turns of the last days fill the history cache",
+    )
+
+    CACHE_CODEC: Literal["json", "binary"] = Field(
+        default="json",
+        description="Format of cached values in Redis, `binary` reads `json` too",
+    )
+    CACHE_COMPRESSION: Literal["none", "zlib", "zstd", "lz4"] = Field(
+        default="zlib", description="Compression of large binary cached values"
+    )
+    CACHE_COMPRESS_THRESHOLD: int = Field(
+        default=1024, description="Binary cached values above this size are compressed"
+    )
+
+    HTTP_MAX_CONNECTIONS: int = Field(
+        default=100, description="Max open connections per upstream host"
+    )
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = Field(
+        default=20, description="Max idle keep-alive connections per upstream host"
+    )
+    HTTP_KEEPALIVE_EXPIRY: float = Field(
+        default=30.0, description="Seconds an idle keep-alive connection is kept"
+    )
+    HTTP2: bool = Field(default=False, description="Use HTTP/2 for upstreams")
+    HTTP_CONNECT_TIMEOUT: float = Field(default=5.0, description="Connect timeout")
+    INTENT_API_TIMEOUT: float = Field(
+        default=10.0, description="Read timeout for the intent/NER service"
+    )
+    QUERY_API_TIMEOUT: float = Field(
+        default=10.0, description="Read timeout for the search service"
+    )
+
+    CHAT_EXTRACTION_MODE: Literal["sequential", "parallel", "adaptive"] = Field(
+        default="adaptive", description="How intent and NER requests are scheduled"
+    )
+    CHAT_ADAPTIVE_WINDOW: int = Field(
+        default=100, description="Number of recent intents for the adaptive mode"
+    )
+    CHAT_ADAPTIVE_OUT_OF_SCOPE_RATIO: float = Field(
+        default=0.5,
+        description="Adaptive mode goes sequential above this out_of_scope ratio",
+    )
+
+    INTENT_BATCH_ENABLED: bool = Field(
+        default=False, description="Send intent/NER requests in micro batches"
+    )
+    INTENT_BATCH_WINDOW_MS: float = Field(
+        default=5.0, description="How long a micro batch collects requests"
+    )
+    INTENT_BATCH_MAX_SIZE: int = Field(
+        default=16, description="Micro batch is sent as soon as it has this size"
+    )
+    INTENT_BATCH_FALLBACK: bool = Field(
+        default=True, description="Retry a failed batch as single requests"
+    )
+
+    INTENT_CACHE_ENABLED: bool = Field(
+        default=True, description="Cache intent/NER results by input text"
+    )
+    INTENT_CACHE_TTL: int = Field(default=600, description="Intent cache TTL, sec")
+    INTENT_CACHE_MAXSIZE: int = Field(
+        default=10_000, description="Max entries in the local intent cache"
+    )
+    INTENT_CACHE_REDIS: bool = Field(
+        default=False, description="Share intent cache between pods via Redis"
+    )
+
+    SEARCH_CACHE_ENABLED: bool = Field(
+        default=True, description="Cache search results by search params"
+    )
+    SEARCH_CACHE_FRESH_TTL: int = Field(
+        default=60, description="Search result is served without refresh, sec"
+    )
+    SEARCH_CACHE_STALE_TTL: int = Field(
+        default=600, description="Stale search result is served while refreshing, sec"
+    )
+    SEARCH_CACHE_MAXSIZE: int = Field(
+        default=1_000, description="Max entries in the local search cache"
+    )
+    SEARCH_CACHE_MAX_BYTES: int = Field(
+        default=32 * 1024 * 1024, description="Max size of the local search cache"
+    )
+    SEARCH_CACHE_REDIS: bool = Field(
+        default=False, description="Share search cache between pods via Redis"
+    )
 
     @property
     def DB_URL(self) -> str:
         return (
             f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:"
             f"{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+            f"?prepared_statement_cache_size={self.DB_STATEMENT_CACHE_SIZE}"
         )
 
     # model_config = SettingsConfigDict(env_file=".env")
@@ -5,6 +5,7 @@ https://github.com/tiangolo/uvicorn-gunicorn-docker/blob/master/docker-images/gu
 """
 
 import multiprocessing
+import os
 from typing import Annotated
 
 from pydantic import Field
@@ -19,7 +20,7 @@ class GunicornConfig(BaseSettings):
     GUNICORN_BIND: str | None = None
     GUNICORN_WORKERS_PER_CORE: int = 1
     GUNICORN_MAX_WORKERS: int = 2
-    GUNICORN_WEB_CONCURRENCY: Annotated[int, Field(strict=True, gt=-1)] = 0
+    GUNICORN_WEB_CONCURRENCY: Annotated[int, Field(ge=0)] = 0
     GUNICORN_GRACEFUL_TIMEOUT: int = 120
     GUNICORN_TIMEOUT: int = 60
     GUNICORN_KEEP_ALIVE: int = 10
@@ -43,7 +44,11 @@ web_concurrency = gunicor_settings["GUNICORN_WEB_CONCURRENCY"]
 cores = multiprocessing.cpu_count()
 default_web_concurrency = workers_per_core * cores + 1
 
-web_concurrency = min(max(int(default_web_concurrency), 2), max_workers)
+if not web_concurrency:
+    web_concurrency = min(max(int(default_web_concurrency), 2), max_workers)
+
+# workers inherit it and split the connection budgets (POOL_SIZING=budget)
+os.environ["WEB_CONCURRENCY"] = str(web_concurrency)
 
 graceful_timeout = gunicor_settings["GUNICORN_GRACEFUL_TIMEOUT"]
 timeout = gunicor_settings["GUNICORN_TIMEOUT"]
@@ -0,0 +1,175 @@
+"""
+Микробенчмарк SafeLRUCache: пропускная способность и задержки get/set,
+без синхронизации и под потоком изменений от другого пода.
+
+Нужен Redis из REDIS_URL, ключи `bench_cache_*` удаляются в конце.
+Задержка операции включает ожидание event loop, как её видит обработчик
+запроса, поэтому применение синхронизации, блокирующее loop, видно в хвосте.
+
+Запуск: `PYTHONPATH=. python scripts/bench_cache.py --help`. Для цифр «до»
+скрипт запускается на старом коде:
+`git worktree add /tmp/old <commit> && PYTHONPATH=/tmp/old python scripts/bench_cache.py`.
+"""
+
+import argparse
+import asyncio
+import inspect
+import random
+import time
+
+from redis.asyncio import Redis
+
+from config.config import settings
+from src.json import json
+from src.utils.cache import SafeLRUCache
+
+REDIS_KEY = "bench_cache"
+PEER = "bench-peer"
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def make_value(items: int) -> list[dict]:
+    return [
+        {
+            "user": "Покажи двухкомнатные квартиры у метро",
+            "assistant": "<p>Нашёл несколько вариантов рядом с метро</p>" * 5,
+            "assistant_send_at": "2026-10-18T10:00:00+00:00",
+        }
+        for _ in range(items)
+    ]
+
+
+async def client(
+    cache: SafeLRUCache,
+    keys: list[str],
+    value: list[dict],
+    set_ratio: float,
+    deadline: float,
+    latencies: dict[str, list[float]],
+) -> None:
+    rnd = random.Random()
+    while time.perf_counter() < deadline:
+        key = rnd.choice(keys)
+        started = time.perf_counter()
+        # a request handler gets the loop only between other callbacks
+        await asyncio.sleep(0)
+        if rnd.random() < set_ratio:
+            await cache.set(key, value)
+            latencies["set"].append(time.perf_counter() - started)
+        else:
+            await cache.get(key)
+            latencies["get"].append(time.perf_counter() - started)
+
+
+async def sync_traffic(
+    redis: Redis,
+    keys: list[str],
+    value: list[dict],
+    rate: int,
+    batch: int,
+    deadline: float,
+) -> int:
+    """Writes `set` messages of another pod to the sync stream"""
+    rnd = random.Random()
+    sent = 0
+    while time.perf_counter() < deadline:
+        payload = json.dumps([value, time.time()])
+        async with redis.pipeline(transaction=False) as pipe:
+            for _ in range(batch):
+                await pipe.xadd(
+                    f"{REDIS_KEY}_stream",
+                    {
+                        "op": "set",
+                        "key": rnd.choice(keys),
+                        "value": payload,
+                        "sender": PEER,
+                    },
+                    maxlen=100_000,
+                    approximate=True,
+                )
+            await pipe.execute()
+        sent += batch
+        await asyncio.sleep(batch / rate)
+    return sent
+
+
+async def run_phase(
+    cache: SafeLRUCache, redis: Redis, args: argparse.Namespace, sync_rate: int
+) -> None:
+    keys = [f"user-{i}" for i in range(args.keys)]
+    value = make_value(args.value_items)
+    latencies: dict[str, list[float]] = {"get": [], "set": []}
+    started = time.perf_counter()
+    deadline = started + args.duration
+
+    tasks = [
+        client(cache, keys, value, args.set_ratio, deadline, latencies)
+        for _ in range(args.clients)
+    ]
+    if sync_rate:
+        tasks.append(
+            sync_traffic(redis, keys, value, sync_rate, args.sync_batch, deadline)
+        )
+    results = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    title = f"sync {sync_rate} msg/s" if sync_rate else "no sync"
+    if sync_rate:
+        title += f", sent {results[-1]}"
+    print(f"\n{title}")
+    print(
+        f"{'op':<4} {'ops':>9} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'p99.9 ms':>9} {'max ms':>8}"
+    )
+    for op, samples in latencies.items():
+        if not samples:
+            continue
+        print(
+            f"{op:<4} {len(samples):>9} {len(samples) / elapsed:>10.0f} "
+            f"{percentile(samples, 0.5) * 1000:>8.3f} "
+            f"{percentile(samples, 0.99) * 1000:>8.3f} "
+            f"{percentile(samples, 0.999) * 1000:>9.3f} "
+            f"{max(samples) * 1000:>8.3f}"
+        )
+
+
+async def main(args: argparse.Namespace) -> None:
+    redis = Redis.from_url(settings.REDIS_URL)
+    cache = SafeLRUCache(max_age=3600, maxsize=args.keys, redis_key=REDIS_KEY)
+    value = make_value(args.value_items)
+    for i in range(args.keys):
+        await cache.set(f"user-{i}", value)
+    # let the write-behind worker and the first stream read settle
+    await asyncio.sleep(2)
+
+    try:
+        await run_phase(cache, redis, args, sync_rate=0)
+        await run_phase(cache, redis, args, sync_rate=args.sync_rate)
+    finally:
+        stopped = cache.stop()
+        if inspect.isawaitable(stopped):
+            await stopped
+        keys = [key async for key in redis.scan_iter(f"{REDIS_KEY}_*")]
+        if keys:
+            await redis.delete(*keys)
+        await redis.aclose()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=5_000)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--set-ratio", type=float, default=0.1)
+    parser.add_argument("--value-items", type=int, default=20)
+    parser.add_argument("--sync-rate", type=int, default=2_000, help="msg/s")
+    parser.add_argument("--sync-batch", type=int, default=500)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,107 @@
+"""
+CPU одного хода чата на попадании в кэш истории: прежний путь через
+pydantic-модели против HistoryBuffer с записью всей истории или только
+нового хода. Redis и БД не нужны, сериализация для Redis входит в замер.
+
+Прежний путь повторяет старые `UserHistory.get`/`update` и
+`ChatUseCase.get_history_str`: `HistoryModel.model_validate` кэшированного
+dict дважды, добавление `ChatItem` и `model_dump(mode="json")` всей истории.
+
+Запуск: `PYTHONPATH=. python scripts/bench_history.py --help`.
+"""
+
+import argparse
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime
+
+from config.config import settings
+from src.json import json
+from src.schema.history import ChatItem, HistoryModel
+from src.service.history_buffer import ChatRecord, HistoryBuffer
+from src.utils.cache_codec import get_codec
+
+QUESTION = "Покажи двухкомнатные квартиры у метро до 15 млн"
+ANSWER = "<p>Нашёл несколько вариантов рядом с метро, вот лучшие из них</p>" * 20
+
+
+def make_items(size: int) -> list[dict]:
+    send_at = datetime.now(UTC).isoformat()
+    return [
+        {"user": QUESTION, "assistant": ANSWER, "assistant_send_at": send_at}
+        for _ in range(size)
+    ]
+
+
+def pydantic_turn(size: int) -> Callable[[], None]:
+    cached = {"data": make_items(size), "fields": {}}
+
+    def turn() -> None:
+        # get_history_str
+        history = HistoryModel.model_validate(cached)
+        history = HistoryModel(data=history.data[-10:])
+        "".join(f"{msg.user}\n" for msg in history.data[-5:]) + QUESTION
+        # update: get + append + dump of the whole history
+        model = HistoryModel.model_validate(cached)
+        model.data.append(
+            ChatItem(
+                user=QUESTION, assistant=ANSWER, assistant_send_at=datetime.now(UTC)
+            )
+        )
+        model.data = model.data[-size:]
+        json.dumpb([model.model_dump(mode="json"), time.time()])
+
+    return turn
+
+
+def buffer_turn(size: int, append_only: bool) -> Callable[[], None]:
+    codec = get_codec(
+        settings.CACHE_CODEC,
+        compression=settings.CACHE_COMPRESSION,
+        compress_threshold=settings.CACHE_COMPRESS_THRESHOLD,
+    )
+    buffer = HistoryBuffer(
+        (ChatRecord(QUESTION, ANSWER, datetime.now(UTC)) for _ in range(size)),
+        capacity=size,
+    )
+
+    def turn() -> None:
+        buffer.context.prompt(QUESTION)
+        record = ChatRecord(QUESTION, ANSWER, datetime.now(UTC))
+        buffer.append(record)
+        if append_only:
+            codec.encode(HistoryBuffer.dump_record(record), time.time())
+        else:
+            codec.encode(HistoryBuffer.dump(buffer), time.time())
+
+    return turn
+
+
+def measure(turn: Callable[[], None], turns: int) -> float:
+    """CPU microseconds per turn"""
+    turn()
+    started = time.process_time()
+    for _ in range(turns):
+        turn()
+    return (time.process_time() - started) / turns * 1e6
+
+
+def main(args: argparse.Namespace) -> None:
+    print(f"codec={settings.CACHE_CODEC}, CPU per chat turn, us")
+    print(f"{'turns kept':>10} {'pydantic':>10} {'buffer':>10} {'append':>10}")
+    for size in args.sizes:
+        before = measure(pydantic_turn(size), args.turns)
+        whole = measure(buffer_turn(size, append_only=False), args.turns)
+        append = measure(buffer_turn(size, append_only=True), args.turns)
+        print(f"{size:>10} {before:>10.1f} {whole:>10.1f} {append:>10.1f}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--turns", type=int, default=2_000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
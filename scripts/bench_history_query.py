@@ -0,0 +1,129 @@
+"""
+Чтение последних сообщений пользователя: прежний ORM-запрос
+(`select(MessageHistory)`, `ChatItem` и сортировка в Python) против
+запросов только нужных колонок из `src.repo.history` для страниц
+10, 100 и 1000 строк.
+
+Нужна БД с применёнными миграциями (POSTGRES_*). Скрипт пишет строки
+тестового пользователя `bench-*` и удаляет их в конце.
+
+Запуск: `PYTHONPATH=. python scripts/bench_history_query.py --help`.
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy import delete, insert
+from sqlmodel import desc, select
+
+from src.db import async_session_maker, engine
+from src.models.history import MessageHistory
+from src.repo.history import get_user_history_rows, get_user_messages_paginated
+from src.schema.history import ChatItem
+from src.service.history_buffer import HistoryBuffer
+
+Query = Callable[..., Awaitable[object]]
+
+
+async def orm_page(session, user_id: str, limit: int) -> list[ChatItem]:
+    """`get_user_messages_paginated` before the change"""
+    statement = select(MessageHistory).where(MessageHistory.user_id == user_id)
+    statement = statement.order_by(desc(MessageHistory.assistant_send_at))
+    statement = statement.limit(limit).offset(0)
+    results = (await session.exec(statement)).all()
+    items = [
+        ChatItem(
+            user=row.user_text,
+            assistant=row.assistant_text,
+            assistant_send_at=row.assistant_send_at,
+        )
+        for row in results
+    ]
+    return sorted(items, key=lambda i: i.assistant_send_at)
+
+
+async def core_items(session, user_id: str, limit: int) -> list[ChatItem]:
+    return await get_user_messages_paginated(session, user_id, limit=limit)
+
+
+async def core_buffer(session, user_id: str, limit: int) -> HistoryBuffer:
+    rows = await get_user_history_rows(session, user_id, limit=limit)
+    return HistoryBuffer.from_rows(rows)
+
+
+QUERIES: dict[str, Query] = {
+    "orm": orm_page,
+    "core items": core_items,
+    "core buffer": core_buffer,
+}
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def seed(user_id: str, rows: int) -> None:
+    now = datetime.now(UTC)
+    values = [
+        {
+            "user_id": user_id,
+            "user_text": "Покажи двухкомнатные квартиры у метро",
+            "assistant_text": "<p>Нашёл несколько вариантов рядом с метро</p>" * 10,
+            "assistant_send_at": now - timedelta(minutes=i),
+        }
+        for i in range(rows)
+    ]
+    async with engine.begin() as conn:
+        await conn.execute(insert(MessageHistory.__table__), values)
+
+
+async def measure(query: Query, user_id: str, limit: int, repeat: int) -> list[float]:
+    samples = []
+    for i in range(repeat + 5):
+        started = time.perf_counter()
+        async with async_session_maker() as session:
+            await query(session, user_id, limit)
+        if i >= 5:
+            # the first runs fill the pool and the prepared statement cache
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def main(args: argparse.Namespace) -> None:
+    user_id = f"bench-{uuid.uuid4().hex[:8]}"
+    await seed(user_id, max(args.pages))
+    try:
+        print(f"{'rows':>5} {'query':<12} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for limit in args.pages:
+            for name, query in QUERIES.items():
+                samples = await measure(query, user_id, limit, args.repeat)
+                print(
+                    f"{limit:>5} {name:<12} "
+                    f"{sum(samples) / len(samples) * 1000:>8.3f} "
+                    f"{percentile(samples, 0.5) * 1000:>8.3f} "
+                    f"{percentile(samples, 0.99) * 1000:>8.3f}"
+                )
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(
+                delete(MessageHistory.__table__).where(
+                    MessageHistory.__table__.c.user_id == user_id
+                )
+            )
+        await engine.dispose()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=200)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,16 +1,38 @@
+import asyncio
+import logging
+from collections import deque
 from datetime import UTC, datetime
+
+from config.config import settings
 from src.application.intent_handler import IntentHandler
 from src.application.ner_resolver import NERPromptResolver
 from src.application.search import SearchEngine
 from src.repo.history_queue import MessageHistoryQueue
+from src.repo.intent_batch import IntentBatcher
+from src.repo.intent_cache import CachedIntentHttp
 from src.repo.intent_http import IntentHttp
 from src.schema.ai_query import AIRequest, AIResponse
+from src.schema.schema import IntentResponse, NERResponse
 from src.service.history import UserHistory
 
+logger = logging.getLogger(__name__)
+
 
 class ChatUseCase:
-    def __init__(self):
-        self.http = IntentHttp()
+    def __init__(
+        self,
+        extraction_mode: str = settings.CHAT_EXTRACTION_MODE,
+        adaptive_window: int = settings.CHAT_ADAPTIVE_WINDOW,
+        adaptive_ratio: float = settings.CHAT_ADAPTIVE_OUT_OF_SCOPE_RATIO,
+    ):
+        self.extraction_mode = extraction_mode
+        self.adaptive_ratio = adaptive_ratio
+        self._recent_out_of_scope: deque[bool] = deque(maxlen=adaptive_window)
+        self.http: IntentHttp | IntentBatcher | CachedIntentHttp = IntentHttp()
+        if settings.INTENT_BATCH_ENABLED:
+            self.http = IntentBatcher(http=self.http)
+        if settings.INTENT_CACHE_ENABLED:
+            self.http = CachedIntentHttp(http=self.http)
         self.ner_resolver = NERPromptResolver()
         self.search_engine = SearchEngine()
         self.intent_handler = IntentHandler(
@@ -29,11 +51,7 @@ class ChatUseCase:
             user_history=user_history,
         )
 
-        intent_result = await self.http.get_intent(text=history_str)
-
-        ner_result = None
-        if intent_result.intent != "out_of_scope":
-            ner_result = await self.http.get_ner(text=history_str)
+        intent_result, ner_result = await self.extract(text=history_str)
 
         full_answer, aditional = await self.intent_handler.handle(
             intent=intent_result.intent, ner=ner_result
@@ -53,14 +71,68 @@ class ChatUseCase:
 
         return AIResponse(answer=full_answer, aditional=aditional, buttons=[])
 
+    async def extract(self, text: str) -> tuple[IntentResponse, NERResponse | None]:
+        """
+        Получает intent и NER для текста.
+
+        В параллельном режиме NER запрашивается одновременно с intent
+        и отменяется, если intent оказался `out_of_scope`.
+        """
+        if self._is_parallel():
+            intent_result, ner_result = await self._extract_parallel(text)
+        else:
+            intent_result, ner_result = await self._extract_sequential(text)
+
+        self._recent_out_of_scope.append(intent_result.intent == "out_of_scope")
+        return intent_result, ner_result
+
+    def _is_parallel(self) -> bool:
+        if self.extraction_mode == "parallel":
+            return True
+        if self.extraction_mode == "sequential":
+            return False
+        if not self._recent_out_of_scope:
+            return True
+        ratio = sum(self._recent_out_of_scope) / len(self._recent_out_of_scope)
+        return ratio <= self.adaptive_ratio
+
+    async def _extract_sequential(
+        self, text: str
+    ) -> tuple[IntentResponse, NERResponse | None]:
+        intent_result = await self.http.get_intent(text=text)
+        ner_result = None
+        if intent_result.intent != "out_of_scope":
+            ner_result = await self.http.get_ner(text=text)
+        return intent_result, ner_result
+
+    async def _extract_parallel(
+        self, text: str
+    ) -> tuple[IntentResponse, NERResponse | None]:
+        ner_task = asyncio.create_task(self.http.get_ner(text=text))
+        ner_task.add_done_callback(self._discard_ner_result)
+        try:
+            intent_result = await self.http.get_intent(text=text)
+        except BaseException:
+            ner_task.cancel()
+            raise
+
+        if intent_result.intent == "out_of_scope":
+            ner_task.cancel()
+            return intent_result, None
+        return intent_result, await ner_task
+
+    @staticmethod
+    def _discard_ner_result(task: asyncio.Task) -> None:
+        # NER may fail after being discarded, retrieve the error so it is not
+        # reported as "Task exception was never retrieved"
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Speculative NER request failed: {task.exception()}")
+
     async def get_history_str(
         self,
         user_id: str,
         user_history: UserHistory,
         question: str,
     ) -> str:
-        history = await user_history.get(user_id=user_id)
-        result = ""
-        for msg in history.data[-5:]:
-            result += f"{msg.user}\n"
-        return result + question
+        context = await user_history.get_context(user_id=user_id)
+        return context.prompt(question)
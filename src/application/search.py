@@ -1,10 +1,14 @@
+from config.config import settings
+from src.repo.search_cache import CachedSearchHttp
 from src.repo.search_http import SearchHttp
 from src.schema.schema import NERResponse
 
 
 class SearchEngine:
     def __init__(self):
-        self.http = SearchHttp()
+        self.http: SearchHttp | CachedSearchHttp = SearchHttp()
+        if settings.SEARCH_CACHE_ENABLED:
+            self.http = CachedSearchHttp(http=self.http)
 
     async def search(self, ner: NERResponse, limit: int = 4) -> list[dict]:
         params = {
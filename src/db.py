@@ -1,18 +1,32 @@
+import asyncio
+import itertools
 import logging
-from collections.abc import AsyncGenerator
+import time
+from collections.abc import AsyncGenerator, Awaitable, Callable
 from contextlib import asynccontextmanager
+from typing import TypeVar
 
 from fastapi import HTTPException
-from sqlalchemy import MetaData
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import MetaData, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import (
+    DBAPIError,
+    InterfaceError,
+    OperationalError,
+    SQLAlchemyError,
+    TimeoutError as PoolTimeoutError,
+)
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlmodel import create_engine
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from config.config import settings
 
 from src.json import json
+from src.utils.metrics import Counter, Histogram, metrics
+from src.utils.pools import db_pool_limits
 
 DB_NAMING_CONVENTION = {
     "all_column_names": lambda constraint, table: "_".join(
@@ -29,29 +43,233 @@ logger = logging.getLogger(__name__)
 
 metadata = MetaData(naming_convention=DB_NAMING_CONVENTION)
 
+T = TypeVar("T")
+
+
+class _InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool recording how long checkouts wait and how often they time out"""
+
+    wait: Histogram | None = None
+    timeouts: Counter | None = None
+
+    def _do_get(self):
+        if self.wait is None:
+            return super()._do_get()
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts.inc()
+            raise
+        finally:
+            self.wait.observe(time.perf_counter() - started)
+
+    def recreate(self):
+        # `dispose` replaces the pool, the new one reports to the same metrics
+        pool = super().recreate()
+        pool.wait, pool.timeouts = self.wait, self.timeouts
+        return pool
+
 
-engine = AsyncEngine(
-    create_engine(
-        settings.DB_URL,
-        echo=False,
-        future=True,
-        json_serializer=json.dumps,
-        json_deserializer=json.loads,
-        pool_size=32,
-        pool_timeout=10,
-        pool_recycle=60 * 2,
-        max_overflow=5,
-        pool_pre_ping=True,
+def _instrument(engine: AsyncEngine, name: str) -> None:
+    prefix = f"{name}_pool"
+    pool = engine.sync_engine.pool
+    pool.wait = metrics.histogram(
+        f"{prefix}_wait_seconds", "Time to check out a DB connection"
     )
+    pool.timeouts = metrics.counter(
+        f"{prefix}_timeouts", "No free DB connection within the pool timeout"
+    )
+    # read through the engine, `dispose` replaces its pool
+    metrics.gauge(
+        f"{prefix}_in_use",
+        "DB connections checked out",
+        func=lambda: engine.sync_engine.pool.checkedout(),
+    )
+    metrics.gauge(
+        f"{prefix}_idle",
+        "Open DB connections waiting in the pool",
+        func=lambda: engine.sync_engine.pool.checkedin(),
+    )
+
+
+def _create_engine(
+    url: str, pool_size: int, max_overflow: int, name: str = "db"
+) -> AsyncEngine:
+    pool_size, max_overflow = db_pool_limits(pool_size, max_overflow)
+    logger.info(f"DB pool {name}: {pool_size=} {max_overflow=}")
+    # replica URLs come from the settings as is, they get the statement
+    # cache of the primary unless they set their own
+    url = make_url(url)
+    if "prepared_statement_cache_size" not in url.query:
+        url = url.update_query_dict(
+            {"prepared_statement_cache_size": str(settings.DB_STATEMENT_CACHE_SIZE)}
+        )
+    engine = AsyncEngine(
+        create_engine(
+            url,
+            echo=False,
+            future=True,
+            json_serializer=json.dumps,
+            json_deserializer=json.loads,
+            poolclass=_InstrumentedPool,
+            pool_size=pool_size,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=60 * 2,
+            max_overflow=max_overflow,
+            pool_pre_ping=True,
+        )
+    )
+    _instrument(engine, name)
+    return engine
+
+
+def _create_session_maker(bind: AsyncEngine) -> sessionmaker:
+    return sessionmaker(
+        bind=bind,
+        class_=AsyncSession,
+        expire_on_commit=False,
+        autocommit=False,
+        autoflush=True,
+    )  # type: ignore
+
+
+engine = _create_engine(
+    settings.DB_URL,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+)
+
+async_session_maker = _create_session_maker(engine)
+
+
+# replication lag in seconds, 0 when the replica has replayed all it received
+_REPLICA_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+            OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+    """
 )
 
-async_session_maker = sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-    autocommit=False,
-    autoflush=True,
-)  # type: ignore
+
+class _Replica:
+    __slots__ = ("engine", "healthy", "lag", "name", "session_maker")
+
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        self.session_maker = _create_session_maker(engine)
+        self.healthy = True
+        self.lag = 0.0
+
+    def in_use(self) -> int:
+        return self.engine.sync_engine.pool.checkedout()
+
+
+class ReadRouter:
+    """
+    Spreads read-only sessions over the replicas of `DB_READ_REPLICA_URLS`.
+
+    Replicas are picked round-robin or by the fewest checked out connections.
+    A background task checks every replica each `check_interval` seconds and
+    skips the ones that fail or lag more than `max_lag` seconds; without
+    healthy replicas reads go to the primary.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        balancing: str = "round_robin",
+        max_lag: float = 10.0,
+        check_interval: float = 5.0,
+        pool_size: int = 16,
+        max_overflow: int = 5,
+    ):
+        self.replicas = [
+            _Replica(
+                name=f"replica{i}",
+                engine=_create_engine(
+                    url, pool_size, max_overflow, name=f"db_replica{i}"
+                ),
+            )
+            for i, url in enumerate(urls)
+        ]
+        self.balancing = balancing
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._counter = itertools.count()
+        self._task: asyncio.Task | None = None
+
+        metrics.gauge(
+            "db_replicas_healthy",
+            "Replicas receiving reads",
+            func=lambda: sum(replica.healthy for replica in self.replicas),
+        )
+        self.primary_reads = metrics.counter(
+            "db_reads_on_primary", "Read sessions sent to the primary"
+        )
+        self.replica_errors = metrics.counter(
+            "db_replica_errors", "Failed replica health checks and reads"
+        )
+
+    def pick(self) -> _Replica | None:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        if self.balancing == "least_connections":
+            return min(healthy, key=_Replica.in_use)
+        return healthy[next(self._counter) % len(healthy)]
+
+    def mark_failed(self, replica: _Replica, error: Exception) -> None:
+        # back in rotation after the next successful check
+        replica.healthy = False
+        self.replica_errors.inc()
+        logger.warning(f"DB {replica.name} is unhealthy: {error}")
+
+    async def _check(self, replica: _Replica) -> None:
+        try:
+            async with asyncio.timeout(self.check_interval):
+                async with replica.engine.connect() as conn:
+                    lag = float((await conn.execute(_REPLICA_LAG_QUERY)).scalar())
+        except Exception as e:
+            self.mark_failed(replica, e)
+            return
+        replica.lag = lag
+        healthy = lag <= self.max_lag
+        if replica.healthy and not healthy:
+            logger.warning(f"DB {replica.name} lags {lag:.1f}s, reading the primary")
+        replica.healthy = healthy
+
+    async def _check_loop(self) -> None:
+        while True:
+            await asyncio.gather(*(self._check(replica) for replica in self.replicas))
+            await asyncio.sleep(self.check_interval)
+
+    def start(self) -> None:
+        if self.replicas and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._check_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+read_router = ReadRouter(
+    urls=settings.DB_READ_REPLICA_URLS,
+    balancing=settings.DB_READ_BALANCING,
+    max_lag=settings.DB_REPLICA_MAX_LAG,
+    check_interval=settings.DB_REPLICA_CHECK_INTERVAL,
+    pool_size=settings.DB_READ_POOL_SIZE,
+    max_overflow=settings.DB_READ_MAX_OVERFLOW,
+)
 
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
@@ -77,6 +295,54 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
         ) from e
 
 
+class ReplicaFailed(Exception):
+    """A replica lost its connection or timed out during a read"""
+
+
+def _is_connection_error(error: BaseException) -> bool:
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(
+        error, (OperationalError, InterfaceError, PoolTimeoutError, OSError)
+    )
+
+
+@asynccontextmanager
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Session for read-only queries, on a replica when one is healthy.
+    A replica whose connection fails inside the block is taken out of
+    rotation and the error is raised as `ReplicaFailed`.
+    """
+    replica = read_router.pick()
+    if replica is None:
+        read_router.primary_reads.inc()
+        async with async_session_maker() as session:
+            yield session
+        return
+
+    try:
+        async with replica.session_maker() as session:
+            yield session
+    except Exception as e:
+        if not _is_connection_error(e):
+            raise
+        read_router.mark_failed(replica, e)
+        raise ReplicaFailed(replica.name) from e
+
+
+async def run_read(query: Callable[[AsyncSession], Awaitable[T]]) -> T:
+    """Runs a read-only query, retrying it on the primary if the replica fails"""
+    try:
+        async with get_read_session() as session:
+            return await query(session)
+    except ReplicaFailed as e:
+        logger.warning(f"Read failed on {e}, retrying on the primary")
+    read_router.primary_reads.inc()
+    async with async_session_maker() as session:
+        return await query(session)
+
+
 @asynccontextmanager
 async def get_transactional_session() -> AsyncGenerator[AsyncSession, None]:
     session = async_session_maker()
@@ -3,25 +3,78 @@ from fastapi import FastAPI, Request, status
 from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from config.config import settings
 from src.application.chat import ChatUseCase
+from src.db import read_router
 from src.repo.history_queue import MessageHistoryQueue
+from src.repo.history_spool import HistorySpool
+from src.repo.http import HttpClients
 from src.routers import router
 from src.service.history import UserHistory
+from src.service.history_buffer import HistoryBuffer
 from src.utils.exceptions import BaseException
 from src.utils.cache import SafeLRUCache
+from src.utils.shm_cache import SharedMemoryTable
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    cache = SafeLRUCache(max_age=60 * 5, maxsize=10_000)
+    app.state.http_clients = HttpClients()
+    read_router.start()
+    shared = None
+    if settings.CACHE_SHARED_MEMORY:
+        # a slot holds a whole history buffer
+        slot_size = (
+            settings.CACHE_SHARED_SLOT_SIZE
+            or settings.HISTORY_BUFFER_SIZE * settings.CACHE_SHARED_TURN_BYTES
+        )
+        shared = SharedMemoryTable(
+            path=settings.CACHE_SHARED_PATH,
+            slots=settings.CACHE_SHARED_SLOTS
+            or max(
+                1,
+                min(settings.CACHE_MAXSIZE, settings.CACHE_MAX_BYTES // slot_size),
+            ),
+            slot_size=slot_size,
+        )
+    cache = SafeLRUCache(
+        max_age=settings.CACHE_MAX_AGE,
+        maxsize=settings.CACHE_MAXSIZE,
+        max_bytes=settings.CACHE_MAX_BYTES,
+        stream_maxlen=settings.CACHE_STREAM_MAXLEN,
+        replication=settings.CACHE_REPLICATION,
+        warmup_keys=settings.CACHE_WARMUP_KEYS,
+        # HistoryBuffer values are lists of turns, pods of older releases
+        # keep reading HistoryModel dicts under the former `lru_cache` keys
+        redis_key="history_cache_v2",
+        shared=shared,
+        value_dump=HistoryBuffer.dump,
+        value_load=HistoryBuffer.load,
+        list_capacity=(
+            settings.HISTORY_BUFFER_SIZE if settings.HISTORY_APPEND_UPDATES else None
+        ),
+        item_dump=HistoryBuffer.dump_record,
+        item_load=HistoryBuffer.load_record,
+    )
     app.state.user_history = UserHistory(cache=cache)
-    app.state.messages_queue = MessageHistoryQueue()
+    spool = None
+    if settings.HISTORY_SPOOL_DIR:
+        spool = HistorySpool(
+            directory=settings.HISTORY_SPOOL_DIR,
+            fsync_interval=settings.HISTORY_SPOOL_FSYNC_INTERVAL,
+            spill_segment_rows=min(
+                settings.HISTORY_FLUSH_SIZE, settings.HISTORY_QUEUE_CAPACITY
+            ),
+        )
+    app.state.messages_queue = MessageHistoryQueue(spool=spool)
     app.state.chat = ChatUseCase()
 
     yield
 
-    cache.stop()
+    await cache.stop()
     await app.state.messages_queue.stop()
+    await app.state.http_clients.aclose()
+    await read_router.stop()
 
 
 app = FastAPI(lifespan=lifespan)
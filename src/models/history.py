@@ -7,13 +7,33 @@ from src.db import metadata
 
 class MessageHistory(SQLModel, table=True, metadata=metadata):
     __tablename__ = "message_history"
+    __table_args__ = (
+        # keyset pagination: WHERE user_id = ? AND (assistant_send_at, id) < ?
+        sa.Index(
+            "ix__message_history__user_id_assistant_send_at_id",
+            "user_id",
+            sa.desc("assistant_send_at"),
+            sa.desc("id"),
+        ),
+        {"postgresql_partition_by": "RANGE (assistant_send_at)"},
+    )
 
-    id: int | None = Field(description="id", primary_key=True, default=None)
-    user_id: str = Field(description="User id", index=True)
+    id: int | None = Field(
+        description="id",
+        primary_key=True,
+        default=None,
+        sa_column_kwargs={
+            "server_default": sa.text("nextval('message_history_id_seq'::regclass)")
+        },
+    )
+    user_id: str = Field(description="User id")
     user_text: str = Field(description="User question text")
     assistant_text: str = Field(description="User question text")
 
     assistant_send_at: datetime = Field(
         description="Date assistant read users question",
-        sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False),
+        # the partition key is a part of the primary key
+        sa_column=sa.Column(
+            sa.DateTime(timezone=True), nullable=False, primary_key=True
+        ),
     )
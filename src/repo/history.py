@@ -1,7 +1,83 @@
+import base64
+import binascii
+from datetime import datetime
+
+from sqlalchemy import bindparam, tuple_
 from sqlmodel import Session, select
 from sqlmodel import desc
+from src.json import json
 from src.models.history import MessageHistory
 from src.schema.history import ChatItem
+from src.utils.exceptions import DataExeption
+
+# user_text, assistant_text, assistant_send_at
+HistoryRow = tuple[str, str, datetime]
+
+
+def encode_cursor(assistant_send_at: datetime, message_id: int | None = None) -> str:
+    """
+    Непрозрачный курсор страницы: время и id самого старого сообщения.
+    Без id курсор сравнивает только время (страницы из кэша истории).
+    """
+    raw = json.dumpb([assistant_send_at.isoformat(), message_id])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int | None]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        send_at, message_id = json.loads(raw)
+        return datetime.fromisoformat(send_at), message_id
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise DataExeption(msg=f"Invalid history cursor: {cursor}") from e
+
+
+def _recent_rows_statement(with_since: bool):
+    statement = select(
+        MessageHistory.user_text,
+        MessageHistory.assistant_text,
+        MessageHistory.assistant_send_at,
+    ).where(MessageHistory.user_id == bindparam("user_id"))
+    if with_since:
+        statement = statement.where(
+            MessageHistory.assistant_send_at >= bindparam("since")
+        )
+    statement = statement.order_by(
+        desc(MessageHistory.assistant_send_at), desc(MessageHistory.id)
+    )
+    return statement.limit(bindparam("limit"))
+
+
+# built once: the SQL text is the same for every call, so asyncpg reuses
+# the prepared statement from its per-connection cache
+_RECENT_ROWS = _recent_rows_statement(with_since=False)
+_RECENT_ROWS_SINCE = _recent_rows_statement(with_since=True)
+
+
+async def get_user_history_rows(
+    session: Session,
+    user_id: str,
+    limit: int = 10,
+    since: datetime | None = None,
+) -> list[HistoryRow]:
+    """
+    Последние сообщения пользователя без ORM: только нужные колонки,
+    порядок задаёт БД.
+
+    :param since: Только сообщения не старше (читаются только новые партиции)
+    :return: Строки (user_text, assistant_text, assistant_send_at)
+        по возрастанию времени
+    """
+    params = {"user_id": user_id, "limit": limit}
+    statement = _RECENT_ROWS
+    if since is not None:
+        params["since"] = since
+        statement = _RECENT_ROWS_SINCE
+
+    results_raw = await session.exec(statement, params=params)
+    rows = results_raw.all()
+    rows.reverse()
+    return rows
 
 
 async def get_user_messages_paginated(
@@ -20,19 +96,67 @@ async def get_user_messages_paginated(
     :param offset: Смещение (для пагинации)
     :return: Список сообщений в виде ChatItem
     """
-    statement = select(MessageHistory).where(MessageHistory.user_id == user_id)
-    statement = statement.order_by(desc(MessageHistory.assistant_send_at))
+    statement = select(
+        MessageHistory.user_text,
+        MessageHistory.assistant_text,
+        MessageHistory.assistant_send_at,
+    ).where(MessageHistory.user_id == user_id)
+    statement = statement.order_by(
+        desc(MessageHistory.assistant_send_at), desc(MessageHistory.id)
+    )
     statement = statement.limit(limit)
     statement = statement.offset(offset)
 
+    results_raw = await session.exec(statement)
+    return [
+        ChatItem(user=user, assistant=assistant, assistant_send_at=send_at)
+        for user, assistant, send_at in reversed(results_raw.all())
+    ]
+
+
+async def get_user_messages_before(
+    session: Session,
+    user_id: str,
+    limit: int = 10,
+    before: str | None = None,
+) -> tuple[list[ChatItem], str | None]:
+    """
+    Получает страницу сообщений пользователя старше курсора `before`.
+
+    Страница читается по индексу (user_id, assistant_send_at DESC, id DESC),
+    поэтому её стоимость не зависит от длины истории.
+
+    :return: Сообщения по возрастанию времени и курсор следующей страницы
+    """
+    statement = select(
+        MessageHistory.id,
+        MessageHistory.user_text,
+        MessageHistory.assistant_text,
+        MessageHistory.assistant_send_at,
+    ).where(MessageHistory.user_id == user_id)
+    if before is not None:
+        send_at, message_id = decode_cursor(before)
+        if message_id is None:
+            statement = statement.where(MessageHistory.assistant_send_at < send_at)
+        else:
+            statement = statement.where(
+                tuple_(MessageHistory.assistant_send_at, MessageHistory.id)
+                < tuple_(send_at, message_id)
+            )
+    statement = statement.order_by(
+        desc(MessageHistory.assistant_send_at), desc(MessageHistory.id)
+    )
+    # one extra row tells whether there is a next page
+    statement = statement.limit(limit + 1)
+
     results_raw = await session.exec(statement)
     results = results_raw.all()
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor(results[-1].assistant_send_at, results[-1].id)
     items = [
-        ChatItem(
-            user=row.user_text,
-            assistant=row.assistant_text,
-            assistant_send_at=row.assistant_send_at,
-        )
-        for row in results
+        ChatItem(user=user, assistant=assistant, assistant_send_at=send_at)
+        for _, user, assistant, send_at in reversed(results)
     ]
-    return sorted(items, key=lambda i: i.assistant_send_at)
+    return items, next_cursor
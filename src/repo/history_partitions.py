@@ -0,0 +1,204 @@
+"""
+Обслуживание месячных партиций `message_history`.
+
+Создаёт партиции на `months_ahead` месяцев вперёд, а партиции старше
+`retention_months` выгружает в `{archive_dir}/{partition}.csv.gz`, затем
+отсоединяет и удаляет. Запуск: `python -m src.repo.history_partitions --help`.
+"""
+
+import argparse
+import asyncio
+import gzip
+import os
+import re
+from datetime import UTC, datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config.config import settings
+from src.db import engine
+import logging
+
+logger = logging.getLogger(__name__)
+
+TABLE = "message_history"
+DEFAULT_PARTITION = f"{TABLE}_default"
+COLUMNS = "id, user_id, user_text, assistant_text, assistant_send_at"
+PARTITION_RE = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def month_start(moment: datetime) -> datetime:
+    moment = moment.astimezone(UTC)
+    return datetime(moment.year, moment.month, 1, tzinfo=UTC)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{TABLE}_p{month:%Y_%m}"
+
+
+async def list_partitions(conn: AsyncConnection) -> dict[str, datetime]:
+    """Monthly partitions attached to the table and their first days"""
+    result = await conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table"
+        ),
+        {"table": TABLE},
+    )
+    partitions = {}
+    for (name,) in result:
+        match = PARTITION_RE.match(name)
+        if match:
+            year, month = map(int, match.groups())
+            partitions[name] = datetime(year, month, 1, tzinfo=UTC)
+    return partitions
+
+
+async def create_partitions(
+    conn: AsyncConnection, months_ahead: int, dry_run: bool = False
+) -> list[str]:
+    existing = await list_partitions(conn)
+    current = month_start(datetime.now(UTC))
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        name = partition_name(month)
+        if name in existing:
+            continue
+        created.append(name)
+        if dry_run:
+            continue
+        await create_partition(conn, month)
+    return created
+
+
+async def create_partition(conn: AsyncConnection, month: datetime) -> None:
+    """
+    Creates the partition of `month` as a separate table, moves the rows of
+    the month out of the default partition and attaches it. Attaching a
+    range that still has rows in the default partition fails, and the rows
+    land there while the month has no partition. Call it in a transaction.
+    """
+    name = partition_name(month)
+    end = add_months(month, 1)
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)"))
+    result = await conn.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            "WHERE assistant_send_at >= :start AND assistant_send_at < :end "
+            f"RETURNING {COLUMNS}) "
+            f"INSERT INTO {name} ({COLUMNS}) SELECT {COLUMNS} FROM moved"
+        ),
+        {"start": month, "end": end},
+    )
+    if result.rowcount:
+        logger.info(f"Moved {result.rowcount} rows from {DEFAULT_PARTITION} to {name}")
+    await conn.execute(
+        text(
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    )
+
+
+async def export_partition(conn: AsyncConnection, name: str, archive_dir: str) -> str:
+    """
+    Exports the rows of a partition to a gzip CSV. The partition stays
+    attached: an old month no longer changes and reading it only takes
+    a share lock on the partition itself.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    tmp_path = f"{path}.tmp"
+    raw = await conn.get_raw_connection()
+    # file calls go to a thread, the loop keeps reading the COPY stream
+    archive = await asyncio.to_thread(gzip.open, tmp_path, "wb")
+    try:
+
+        async def write(chunk: bytes) -> None:
+            await asyncio.to_thread(archive.write, chunk)
+
+        await raw.driver_connection.copy_from_table(
+            name, output=write, format="csv", header=True
+        )
+    finally:
+        await asyncio.to_thread(archive.close)
+    await asyncio.to_thread(_fsync, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _fsync(path: str) -> None:
+    with open(path, "rb") as file:
+        os.fsync(file.fileno())
+
+
+async def drop_partition(conn: AsyncConnection, name: str) -> None:
+    # DETACH locks the whole table, keep this transaction short
+    await conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+    await conn.execute(text(f"DROP TABLE {name}"))
+
+
+async def archive_partitions(
+    retention_months: int, archive_dir: str, dry_run: bool = False
+) -> list[str]:
+    cutoff = add_months(month_start(datetime.now(UTC)), -retention_months)
+    async with engine.connect() as conn:
+        partitions = await list_partitions(conn)
+
+    archived = []
+    for name, month in sorted(partitions.items(), key=lambda item: item[1]):
+        if add_months(month, 1) > cutoff:
+            continue
+        archived.append(name)
+        if dry_run:
+            continue
+        # a failed export leaves the partition attached
+        async with engine.connect() as conn:
+            path = await export_partition(conn, name, archive_dir)
+        async with engine.begin() as conn:
+            await drop_partition(conn, name)
+        logger.info(f"Archived {name} to {path}")
+    return archived
+
+
+async def main(args: argparse.Namespace) -> None:
+    async with engine.begin() as conn:
+        created = await create_partitions(conn, args.months_ahead, args.dry_run)
+    logger.info(f"Created partitions: {created}")
+
+    if args.retention_months is not None:
+        archived = await archive_partitions(
+            args.retention_months, args.archive_dir, args.dry_run
+        )
+        logger.info(f"Archived partitions: {archived}")
+    await engine.dispose()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--months-ahead", type=int, default=settings.HISTORY_PARTITIONS_AHEAD
+    )
+    parser.add_argument(
+        "--retention-months",
+        type=int,
+        default=settings.HISTORY_RETENTION_MONTHS,
+        help="archive partitions older than this, keep everything if not set",
+    )
+    parser.add_argument("--archive-dir", default=settings.HISTORY_ARCHIVE_DIR)
+    parser.add_argument("--dry-run", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parse_args()))
@@ -1,23 +1,160 @@
 import asyncio
+import random
+import time
+from collections import deque
 from datetime import datetime
+from typing import Literal
 
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from config.config import settings
 from src.db import get_transactional_session
+from src.json import json
 from src.models.history import MessageHistory
+from src.repo.history_spool import HistorySpool
+from src.utils.metrics import metrics
 from src.utils.singleton import SingletonMeta
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _poison_error(error: BaseException | None) -> BaseException | None:
+    """Finds an error caused by the rows themselves, a retry would fail again"""
+    while error is not None:
+        if isinstance(error, (DataError, IntegrityError)):
+            return error
+        error = error.__cause__
+    return None
+
+
 class MessageHistoryQueue(metaclass=SingletonMeta):
-    def __init__(self, flush_interval: int = 60):
-        self._queue: list[MessageHistory] = []
-        self._lock = asyncio.Lock()
+    """
+    Write-behind buffer of chat turns.
+
+    `add` only appends a row to the current buffer and never waits for the
+    database. The flush task swaps the buffer for an empty one and writes
+    the rows with bulk `INSERT`s of `chunk_size` rows when `flush_size` rows
+    are buffered or `flush_interval` seconds have passed, whichever comes
+    first.
+
+    At most `capacity` rows are kept in memory. When it is full `overflow`
+    decides: `block` makes `add` wait up to `block_timeout` seconds for a
+    flush, `drop_oldest` drops the oldest buffered row and `spill` writes new
+    rows only to the spool until the queue has room again. Rows that can not
+    be kept are dropped and counted. A row dropped by `drop_oldest` stays in
+    its spool segment and is written after a crash recovery.
+
+    A failed chunk and the rows after it go back to the buffer and the next
+    flush waits with exponential backoff and jitter. A chunk rejected for
+    its data is bisected to find the bad rows, they go to the dead-letter
+    file so the rest of the chunk is saved.
+
+    With a `spool` every row is also appended to a local segment file, the
+    segments are removed only after their rows are committed and the rows
+    of segments left by a crashed worker are flushed after startup.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = settings.HISTORY_FLUSH_INTERVAL,
+        flush_size: int = settings.HISTORY_FLUSH_SIZE,
+        spool: HistorySpool | None = None,
+        capacity: int = settings.HISTORY_QUEUE_CAPACITY,
+        overflow: Literal[
+            "block", "drop_oldest", "spill"
+        ] = settings.HISTORY_QUEUE_OVERFLOW,
+        block_timeout: float = settings.HISTORY_QUEUE_BLOCK_TIMEOUT,
+        chunk_size: int = settings.HISTORY_FLUSH_CHUNK_SIZE,
+        retry_base_delay: float = settings.HISTORY_RETRY_BASE_DELAY,
+        retry_max_delay: float = settings.HISTORY_RETRY_MAX_DELAY,
+        dead_letter_path: str | None = settings.HISTORY_DEAD_LETTER_PATH,
+    ):
+        if overflow == "spill" and spool is None:
+            logger.warning("History queue can not spill without a spool, dropping")
+            overflow = "drop_oldest"
+
+        self._buffer: deque[dict] = deque()
+        # rows taken by the running flush
+        self._inflight: list[dict] = []
+        self._spool = spool
+        # spool segments holding the rows of `_buffer`
+        self._segments = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_event = asyncio.Event()
+        self._space = asyncio.Event()
         self._flush_interval = flush_interval
+        self._flush_size = flush_size
+        self._capacity = capacity
+        self._overflow = overflow
+        self._block_timeout = block_timeout
+        self._chunk_size = chunk_size
+        self._retry_base_delay = retry_base_delay
+        self._retry_max_delay = retry_max_delay
+        self._retry_attempt = 0
+        self._retry_at: float | None = None
+        self._dead_letter_path = dead_letter_path
         self._stop_event = asyncio.Event()
 
+        metrics.gauge(
+            "history_queue_depth",
+            "Chat turns waiting to be written to the database",
+            func=self._depth,
+        )
+        metrics.gauge(
+            "history_queue_oldest_seconds",
+            "Age of the oldest chat turn in memory",
+            func=self._oldest_age,
+        )
+        self.flush_rows = metrics.histogram(
+            "history_flush_size",
+            "Rows per history insert",
+            buckets=(1, 10, 50, 100, 500, 1000, 5000),
+        )
+        self.flush_latency = metrics.histogram(
+            "history_flush_seconds", "History insert latency"
+        )
+        self.flush_errors = metrics.counter(
+            "history_flush_errors", "Failed history inserts"
+        )
+        self.retries = metrics.counter(
+            "history_flush_retries", "History flushes retried after a failure"
+        )
+        self.dropped = metrics.counter(
+            "history_dropped", "Chat turns dropped because the queue was full"
+        )
+        self.spilled = metrics.counter(
+            "history_spilled", "Chat turns spilled to disk because the queue was full"
+        )
+        self.dead_letters = metrics.counter(
+            "history_dead_letters", "Chat turns rejected by the database"
+        )
+
+        if spool is not None:
+            spool.recover()
+            self._unspill()
+
         loop = asyncio.get_running_loop()
         self.task = loop.create_task(self._run())
+        if self._buffer:
+            self._flush_event.set()
+
+    def _memory_depth(self) -> int:
+        return len(self._buffer) + len(self._inflight)
+
+    def _depth(self) -> int:
+        spilled = self._spool.spilled_rows if self._spool is not None else 0
+        return self._memory_depth() + spilled
+
+    def _oldest_age(self) -> float:
+        if self._inflight:
+            oldest = self._inflight[0]
+        elif self._buffer:
+            oldest = self._buffer[0]
+        else:
+            return 0.0
+        return max(0.0, time.time() - oldest["assistant_send_at"].timestamp())
 
     async def add(
         self,
@@ -26,41 +163,173 @@ class MessageHistoryQueue(metaclass=SingletonMeta):
         assistant_text: str,
         assistant_send_at: datetime,
     ):
-        message = MessageHistory(
-            user_id=user_id,
-            user_text=user_text,
-            assistant_text=assistant_text,
-            assistant_send_at=assistant_send_at,
-        )
-        async with self._lock:
-            self._queue.append(message)
+        row = {
+            "user_id": user_id,
+            "user_text": user_text,
+            "assistant_text": assistant_text,
+            "assistant_send_at": assistant_send_at,
+        }
+        if self._overflow == "spill":
+            # while older rows wait on disk new ones go there too, keeping order
+            if self._spool.spilled_rows or self._memory_depth() >= self._capacity:
+                self._spool.spill(row)
+                self.spilled.inc()
+                return
+        elif self._memory_depth() >= self._capacity and not await self._make_room():
+            self.dropped.inc()
+            logger.error(f"History queue is full, dropping a message of {user_id=}")
+            return
+
+        if self._spool is not None:
+            self._spool.write(row)
+        self._buffer.append(row)
+        if len(self._buffer) >= self._flush_size and self._retry_at is None:
+            self._flush_event.set()
+
+    async def _make_room(self) -> bool:
+        if self._overflow == "drop_oldest":
+            if not self._buffer:
+                return False
+            self._buffer.popleft()
+            self.dropped.inc()
+            return True
+
+        try:
+            async with asyncio.timeout(self._block_timeout):
+                while self._memory_depth() >= self._capacity:
+                    self._space.clear()
+                    await self._space.wait()
+        except TimeoutError:
+            return False
+        return True
+
+    def _unspill(self) -> None:
+        """Moves spilled rows back to memory while they fit"""
+        while self._spool is not None:
+            loaded = self._spool.unspill(
+                room=self._capacity - self._memory_depth(),
+                force=not self._memory_depth(),
+            )
+            if loaded is None:
+                break
+            rows, segment = loaded
+            self._buffer.extend(rows)
+            self._segments.append(segment)
+        if len(self._buffer) >= self._flush_size:
+            self._flush_event.set()
 
     async def _flush(self):
-        async with self._lock:
-            messages_to_save = self._queue[:]
+        async with self._flush_lock:
+            rows, self._buffer = list(self._buffer), deque()
+            segments, self._segments = self._segments, []
+            if self._spool is not None:
+                # sealed together with the swap, the segment has exactly `rows`
+                segment = await self._spool.rotate()
+                if segment is not None:
+                    segments.append(segment)
+            if not rows:
+                if self._spool is not None:
+                    self._spool.remove(segments)
+                return
 
-            if not messages_to_save:
+            self._inflight = rows
+            started = time.perf_counter()
+            try:
+                failed = await self._insert_chunks(rows)
+            finally:
+                self._inflight = []
+                self.flush_latency.observe(time.perf_counter() - started)
+                self.flush_rows.observe(len(rows))
+
+            if failed:
+                # keep the order, rows added meanwhile go after the failed ones
+                self._buffer.extendleft(reversed(failed))
+                self._segments[:0] = segments
+                self._schedule_retry()
+            else:
+                self._retry_attempt = 0
+                if self._spool is not None:
+                    self._spool.remove(segments)
+                self._unspill()
+            self._space.set()
+
+    async def _insert_chunks(self, rows: list[dict]) -> list[dict]:
+        """Inserts rows chunk by chunk and returns the rows not saved"""
+        for start in range(0, len(rows), self._chunk_size):
+            try:
+                await self._insert_isolating(rows[start : start + self._chunk_size])
+            except Exception as e:
+                self.flush_errors.inc()
+                logger.error(f"Faild to create save message {e}", exc_info=True)
+                return rows[start:]
+        logger.info(f"Created {len(rows)} new messages")
+        return []
+
+    async def _insert_isolating(self, rows: list[dict]) -> None:
+        try:
+            await self._insert(rows)
+        except Exception as e:
+            poison = _poison_error(e)
+            if poison is None:
+                raise
+            if len(rows) == 1:
+                self._dead_letter(rows[0], poison)
                 return
+            middle = len(rows) // 2
+            await self._insert_isolating(rows[:middle])
+            await self._insert_isolating(rows[middle:])
 
-            async with get_transactional_session() as session:
-                try:
-                    session.add_all(messages_to_save)
-                    await session.commit()
-                    self._queue.clear()
-                    logger.info(f"Created {len(messages_to_save)} new messages")
-                except Exception as e:
-                    await session.rollback()
-                    logger.error(f"Faild to create save message {e}", exc_info=True)
+    async def _insert(self, rows: list[dict]) -> None:
+        async with get_transactional_session() as session:
+            await session.execute(insert(MessageHistory.__table__), rows)
+            await session.commit()
+
+    def _dead_letter(self, row: dict, error: BaseException) -> None:
+        self.dead_letters.inc()
+        logger.error(f"Chat turn rejected by the database: {error}")
+        if self._dead_letter_path is None:
+            return
+        try:
+            with open(self._dead_letter_path, "ab") as file:
+                file.write(json.dumpb({"row": row, "error": str(error)}) + b"\n")
+        except OSError as e:
+            logger.error(f"Failed to write the history dead letter: {e}")
+
+    def _schedule_retry(self) -> None:
+        self._retry_attempt += 1
+        self.retries.inc()
+        delay = min(
+            self._retry_max_delay,
+            self._retry_base_delay * 2 ** (self._retry_attempt - 1),
+        )
+        delay *= random.uniform(0.5, 1.0)
+        self._retry_at = asyncio.get_running_loop().time() + delay
 
     async def _run(self):
+        loop = asyncio.get_running_loop()
         try:
             while not self._stop_event.is_set():
-                await asyncio.sleep(self._flush_interval)
+                timeout = self._flush_interval
+                if self._retry_at is not None:
+                    timeout = max(0.0, self._retry_at - loop.time())
+                try:
+                    await asyncio.wait_for(self._flush_event.wait(), timeout=timeout)
+                except TimeoutError:
+                    pass
+                self._flush_event.clear()
+                if self._retry_at is not None and loop.time() < self._retry_at:
+                    continue
+                self._retry_at = None
                 await self._flush()
         except asyncio.CancelledError:
             logger.info("Flush task cancelled")
 
     async def stop(self):
+        # not cancelled: the rows of a running flush are only in its locals
         self._stop_event.set()
-        self.task.cancel()
+        self._flush_event.set()
+        await self.task
         await self._flush()
+        if self._spool is not None:
+            self._spool.release(self._segments)
+            await self._spool.close()
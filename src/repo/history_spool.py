@@ -0,0 +1,262 @@
+import asyncio
+import fcntl
+import glob
+import os
+import struct
+import uuid
+import zlib
+from collections import deque
+from datetime import UTC, datetime
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Segment:
+    __slots__ = ("fd", "path", "records")
+
+    def __init__(self, fd: int, path: str, records: int = 0):
+        self.fd = fd
+        self.path = path
+        self.records = records
+
+
+class HistorySpool:
+    """
+    Append-only on-disk copy of chat turns not yet written to the database.
+
+    Every worker appends to its own segment file. A record is its payload
+    length and crc32 followed by the payload: the send time (float64) and
+    the user id, user text and assistant text as length-prefixed UTF-8.
+    Writes go to the page cache at once and are fsync'd in groups every
+    `fsync_interval` seconds in a thread.
+
+    The queue seals the active segment when it takes rows for a flush and
+    removes the sealed segments once the rows are committed.
+
+    Rows that do not fit in the queue memory are spilled: they are written
+    only to spill segments of `spill_segment_rows` records and are loaded
+    back in order (`unspill`) when the queue has room. Segments left by
+    dead workers are claimed at startup and are loaded the same way: the
+    worker takes the segment `flock` (held by the owner while it is alive)
+    and renames the file into its own namespace.
+    """
+
+    SUFFIX = ".seg"
+    RECORD_HEADER = struct.Struct("<II")
+    TIMESTAMP = struct.Struct("<d")
+    LENGTH = struct.Struct("<I")
+
+    def __init__(
+        self,
+        directory: str,
+        fsync_interval: float = 0.05,
+        spill_segment_rows: int = 1000,
+    ):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.spill_segment_rows = spill_segment_rows
+        self.prefix = f"{os.getenv('HOSTNAME', 'unknownpod')}-{os.getpid()}-"
+        self.prefix += uuid.uuid4().hex[:8]
+        self._counter = 0
+        self._active: _Segment | None = None
+        self._spill_active: _Segment | None = None
+        self._spilled: deque[_Segment] = deque()
+        self._dirty = False
+        self._sync_handle: asyncio.TimerHandle | None = None
+        self._sync_task: asyncio.Task | None = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _next_path(self) -> str:
+        self._counter += 1
+        return os.path.join(
+            self.directory, f"{self.prefix}-{self._counter:06d}{self.SUFFIX}"
+        )
+
+    def _open(self, path: str) -> _Segment:
+        fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return _Segment(fd, path)
+
+    @classmethod
+    def pack(cls, row: dict) -> bytes:
+        payload = [cls.TIMESTAMP.pack(row["assistant_send_at"].timestamp())]
+        for field in ("user_id", "user_text", "assistant_text"):
+            raw = str(row[field]).encode()
+            payload.append(cls.LENGTH.pack(len(raw)))
+            payload.append(raw)
+        data = b"".join(payload)
+        return cls.RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        (timestamp,) = cls.TIMESTAMP.unpack_from(data)
+        offset = cls.TIMESTAMP.size
+        fields = []
+        for _ in range(3):
+            (length,) = cls.LENGTH.unpack_from(data, offset)
+            offset += cls.LENGTH.size
+            fields.append(data[offset : offset + length].decode())
+            offset += length
+        user_id, user_text, assistant_text = fields
+        return {
+            "user_id": user_id,
+            "user_text": user_text,
+            "assistant_text": assistant_text,
+            "assistant_send_at": datetime.fromtimestamp(timestamp, UTC),
+        }
+
+    def write(self, row: dict) -> None:
+        if self._active is None:
+            self._active = self._open(self._next_path())
+        self._append(self._active, row)
+
+    def spill(self, row: dict) -> None:
+        """Keeps a row that does not fit in the queue memory only on disk"""
+        if self._spill_active is None:
+            self._spill_active = self._open(self._next_path())
+        self._append(self._spill_active, row)
+        if self._spill_active.records >= self.spill_segment_rows:
+            self._spilled.append(self._spill_active)
+            self._spill_active = None
+
+    @property
+    def spilled_rows(self) -> int:
+        rows = sum(segment.records for segment in self._spilled)
+        if self._spill_active is not None:
+            rows += self._spill_active.records
+        return rows
+
+    def unspill(
+        self, room: int, force: bool = False
+    ) -> tuple[list[dict], _Segment] | None:
+        """
+        Reads the oldest spilled segment if it has at most `room` rows (or
+        any size with `force`). The caller removes the segment after the
+        rows are committed.
+        """
+        if not self._spilled and self._spill_active is not None:
+            self._spilled.append(self._spill_active)
+            self._spill_active = None
+        if not self._spilled or (self._spilled[0].records > room and not force):
+            return None
+        segment = self._spilled.popleft()
+        return self._read(segment.fd, segment.path), segment
+
+    def _append(self, segment: _Segment, row: dict) -> None:
+        os.write(segment.fd, self.pack(row))
+        segment.records += 1
+        self._dirty = True
+        if self._sync_handle is None:
+            loop = asyncio.get_running_loop()
+            self._sync_handle = loop.call_later(self.fsync_interval, self._start_sync)
+
+    def _start_sync(self) -> None:
+        self._sync_handle = None
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self._sync())
+
+    async def _sync(self) -> None:
+        # the last sealed spill segment may have writes of this group too
+        sealed = self._spilled[-1] if self._spilled else None
+        segments = [
+            segment
+            for segment in (self._active, self._spill_active, sealed)
+            if segment is not None
+        ]
+        if not self._dirty or not segments:
+            return
+        self._dirty = False
+        try:
+            for segment in segments:
+                await asyncio.to_thread(os.fsync, segment.fd)
+        except OSError as e:
+            logger.error(f"History spool fsync error: {e}")
+
+    async def rotate(self) -> _Segment | None:
+        """
+        Seals the active segment, rows written later go to a new one. The
+        segment is taken before the first await, so it holds exactly the
+        rows written before the call.
+        """
+        segment, self._active = self._active, None
+        if segment is not None:
+            if self._sync_task is not None:
+                await self._sync_task
+            await asyncio.to_thread(os.fsync, segment.fd)
+        return segment
+
+    def remove(self, segments: list[_Segment]) -> None:
+        for segment in segments:
+            try:
+                os.unlink(segment.path)
+            except FileNotFoundError:
+                pass
+            os.close(segment.fd)
+
+    def release(self, segments: list[_Segment]) -> None:
+        """Keeps the files of unflushed rows for the replay after restart"""
+        for segment in segments:
+            os.close(segment.fd)
+
+    def recover(self) -> int:
+        """Claims segments of dead workers, their rows are read by `unspill`"""
+        rows = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, f"*{self.SUFFIX}"))):
+            if os.path.basename(path).startswith(self.prefix):
+                continue
+            try:
+                fd = os.open(path, os.O_RDWR | os.O_APPEND)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                claimed = self._next_path()
+                os.rename(path, claimed)
+            except (BlockingIOError, FileNotFoundError):
+                # the owner is alive or another worker claimed it first
+                os.close(fd)
+                continue
+            segment = _Segment(fd, claimed, len(self._read(fd, claimed)))
+            if segment.records:
+                self._spilled.append(segment)
+                rows += segment.records
+            else:
+                self.remove([segment])
+        if rows:
+            logger.warning(f"Recovered {rows} chat turns from the history spool")
+        return rows
+
+    def _read(self, fd: int, path: str) -> list[dict]:
+        data = os.pread(fd, os.fstat(fd).st_size, 0)
+        rows = []
+        offset = 0
+        while offset + self.RECORD_HEADER.size <= len(data):
+            length, crc = self.RECORD_HEADER.unpack_from(data, offset)
+            start = offset + self.RECORD_HEADER.size
+            payload = data[start : start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            rows.append(self.unpack(payload))
+            offset = start + length
+        if offset < len(data):
+            # a write torn by the crash, everything before it is intact
+            logger.warning(f"Ignoring {len(data) - offset} bytes at the end of {path}")
+        return rows
+
+    async def close(self) -> None:
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+        segment = await self.rotate()
+        if segment is not None:
+            if segment.records:
+                self.release([segment])
+            else:
+                self.remove([segment])
+        if self._spill_active is not None:
+            self._spilled.append(self._spill_active)
+            self._spill_active = None
+        self.release(list(self._spilled))
+        self._spilled.clear()
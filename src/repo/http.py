@@ -1,23 +1,87 @@
+import importlib.util
 import logging
 from collections.abc import Callable, Coroutine
 from functools import wraps
 from typing import Any
+from urllib.parse import urlsplit
 
 import httpx
 
+from config.config import settings
 from src.utils.exceptions import APIException
+from src.utils.singleton import SingletonMeta
 
 
 logger = logging.getLogger(__name__)
 
 
+class HttpClients(metaclass=SingletonMeta):
+    """
+    App-scoped registry of pooled http clients, one per upstream host.
+
+    Clients are created lazily and keep their keep-alive pool for the whole
+    app lifetime, `aclose` is called from the FastAPI lifespan.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = settings.HTTP_KEEPALIVE_EXPIRY,
+        http2: bool = settings.HTTP2,
+        connect_timeout: float = settings.HTTP_CONNECT_TIMEOUT,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.connect_timeout = connect_timeout
+        self.http2 = http2 and self._http2_available()
+        self.read_timeouts: dict[str, float] = {
+            self._host(settings.INTENT_API_URL): settings.INTENT_API_TIMEOUT,
+            self._host(settings.QUERY_API_URL): settings.QUERY_API_TIMEOUT,
+        }
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    @staticmethod
+    def _host(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    @staticmethod
+    def _http2_available() -> bool:
+        if importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP2 is enabled but `h2` is not installed, using HTTP/1.1")
+            return False
+        return True
+
+    def client(self, url: str) -> httpx.AsyncClient:
+        host = self._host(url)
+        client = self._clients.get(host)
+        if client is None or client.is_closed:
+            read_timeout = self.read_timeouts.get(host, 30.0)
+            client = httpx.AsyncClient(
+                limits=self.limits,
+                http2=self.http2,
+                timeout=httpx.Timeout(read_timeout, connect=self.connect_timeout),
+            )
+            self._clients[host] = client
+        return client
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
 def async_request():
     def decorator(func: Callable[..., Coroutine[Any, Any, Any]]):
         @wraps(func)
         async def wrapper(*args, **kwargs) -> Any:
             try:
-                async with httpx.AsyncClient() as client:
-                    return await func(*args, client=client, **kwargs)
+                client = HttpClients().client(kwargs["url"])
+                return await func(*args, client=client, **kwargs)
             except Exception as e:
                 message = f"Failed to {func.__name__.upper()} response {str(e)}"
                 logger.error(message, exc_info=True)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any, Literal
+
+from config.config import settings
+from src.repo.intent_http import IntentHttp
+from src.schema.schema import IntentResponse, NERResponse
+from src.utils.exceptions import APIException
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+Kind = Literal["intent", "ner"]
+
+_batch_size = metrics.histogram(
+    "intent_batch_size",
+    "Realized intent/NER micro batch size",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+_batch_fallbacks = metrics.counter(
+    "intent_batch_fallbacks", "Batches retried as single requests"
+)
+
+
+class IntentBatcher:
+    """
+    Collects concurrent `get_intent`/`get_ner` calls and sends them to the
+    batch endpoints of the intent service.
+
+    A batch is sent after `window_ms` since its first request or as soon as
+    it reaches `max_size`. Every caller gets its own result.
+    """
+
+    def __init__(
+        self,
+        http: IntentHttp,
+        window_ms: float = settings.INTENT_BATCH_WINDOW_MS,
+        max_size: int = settings.INTENT_BATCH_MAX_SIZE,
+        fallback: bool = settings.INTENT_BATCH_FALLBACK,
+    ):
+        self.http = http
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.fallback = fallback
+        self._pending: dict[Kind, list[tuple[str, asyncio.Future]]] = {
+            "intent": [],
+            "ner": [],
+        }
+        self._timers: dict[Kind, asyncio.TimerHandle | None] = {
+            "intent": None,
+            "ner": None,
+        }
+        self._tasks: set[asyncio.Task] = set()
+
+    async def get_intent(self, text: str) -> IntentResponse:
+        return await self._submit("intent", text)
+
+    async def get_ner(self, text: str) -> NERResponse:
+        return await self._submit("ner", text)
+
+    async def _submit(self, kind: Kind, text: str) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending[kind]
+        pending.append((text, future))
+
+        if len(pending) >= self.max_size:
+            self._flush(kind)
+        elif len(pending) == 1:
+            self._timers[kind] = loop.call_later(self.window, self._flush, kind)
+
+        return await future
+
+    def _flush(self, kind: Kind) -> None:
+        timer = self._timers[kind]
+        if timer is not None:
+            timer.cancel()
+            self._timers[kind] = None
+
+        items, self._pending[kind] = self._pending[kind], []
+        items = [(text, future) for text, future in items if not future.done()]
+        if not items:
+            return
+
+        task = asyncio.create_task(self._send(kind, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, kind: Kind, items: list[tuple[str, asyncio.Future]]):
+        _batch_size.observe(len(items))
+        single, batch = self._handlers(kind)
+        texts = [text for text, _ in items]
+
+        if len(items) == 1:
+            results = await asyncio.gather(
+                single(text=texts[0]), return_exceptions=True
+            )
+        else:
+            try:
+                results = await batch(texts)
+                if len(results) != len(items):
+                    raise APIException(
+                        msg=f"Batch {kind} returned {len(results)} of {len(items)}"
+                    )
+            except Exception as e:
+                if not self.fallback:
+                    results = [e] * len(items)
+                else:
+                    logger.warning(f"Batch {kind} failed, sending single requests: {e}")
+                    _batch_fallbacks.inc()
+                    results = await asyncio.gather(
+                        *(single(text=text) for text in texts),
+                        return_exceptions=True,
+                    )
+
+        for (_, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _handlers(
+        self, kind: Kind
+    ) -> tuple[Callable[..., Awaitable[Any]], Callable[..., Awaitable[list]]]:
+        if kind == "intent":
+            return self.http.get_intent, self.http.get_intents
+        return self.http.get_ner, self.http.get_ners
@@ -0,0 +1,123 @@
+import hashlib
+import logging
+from typing import Literal
+
+from redis.asyncio import Redis
+
+from config.config import settings
+from src.json import json
+from src.repo.intent_batch import IntentBatcher
+from src.repo.intent_http import IntentHttp
+from src.schema.base import BaseModel, Model
+from src.schema.schema import IntentResponse, NERResponse
+from src.utils.local_cache import TTLCache
+from src.utils.metrics import metrics
+from src.utils.pools import redis_pool
+from src.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+Kind = Literal["intent", "ner"]
+
+
+class CachedIntentHttp:
+    """
+    Content-addressed cache around the intent/NER client.
+
+    Results are keyed by a hash of the normalized input text. The first tier
+    is an in-process TTL/LRU cache, the optional second tier is Redis and is
+    shared by all pods.
+    """
+
+    def __init__(
+        self,
+        http: IntentHttp | IntentBatcher,
+        ttl: int = settings.INTENT_CACHE_TTL,
+        maxsize: int = settings.INTENT_CACHE_MAXSIZE,
+        use_redis: bool = settings.INTENT_CACHE_REDIS,
+        redis_key: str = "intent_cache",
+    ):
+        self.http = http
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.redis_key = redis_key
+        self.redis: Redis | None = None
+        if use_redis:
+            self.redis = Redis(
+                connection_pool=redis_pool(redis_key, timeout=1, socket_timeout=1)
+            )
+
+        self.hits = metrics.counter("intent_cache_hits", "Local intent cache hits")
+        self.redis_hits = metrics.counter(
+            "intent_cache_redis_hits", "Redis intent cache hits"
+        )
+        self.misses = metrics.counter("intent_cache_misses", "Intent cache misses")
+        self.flight = SingleFlight("intent")
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        lines = (" ".join(line.split()) for line in text.lower().splitlines())
+        return "\n".join(line for line in lines if line)
+
+    def _get_key(self, kind: Kind, text: str) -> str:
+        digest = hashlib.blake2b(
+            self.normalize(text).encode("utf-8"), digest_size=16
+        ).hexdigest()
+        return f"{kind}:{digest}"
+
+    async def get_intent(self, text: str) -> IntentResponse:
+        return await self._get("intent", text, IntentResponse)
+
+    async def get_ner(self, text: str) -> NERResponse:
+        return await self._get("ner", text, NERResponse)
+
+    async def _get(self, kind: Kind, text: str, model: type[Model]) -> Model:
+        key = self._get_key(kind, text)
+
+        result = self.local.get(key)
+        if result is not None:
+            self.hits.inc()
+            return result
+
+        result = await self._get_from_redis(key, model)
+        if result is not None:
+            self.redis_hits.inc()
+            self.local.set(key, result)
+            return result
+
+        self.misses.inc()
+        return await self.flight.do(key, lambda: self._fetch(kind, key, text))
+
+    async def _fetch(self, kind: Kind, key: str, text: str) -> BaseModel:
+        if kind == "intent":
+            result = await self.http.get_intent(text=text)
+        else:
+            result = await self.http.get_ner(text=text)
+
+        self.local.set(key, result)
+        await self._save_to_redis(key, result)
+        return result
+
+    async def _get_from_redis(self, key: str, model: type[Model]) -> Model | None:
+        if self.redis is None:
+            return None
+        try:
+            raw = await self.redis.get(f"{self.redis_key}:{key}")
+            if raw is None:
+                return None
+            return model.model_validate(json.loads(raw))
+        except Exception as e:
+            logger.error(f"Intent cache redis read error key={key}: {e}")
+            return None
+
+    async def _save_to_redis(self, key: str, value: BaseModel) -> None:
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(
+                f"{self.redis_key}:{key}",
+                json.dumpb(value.model_dump(mode="json")),
+                ex=self.ttl,
+            )
+        except Exception as e:
+            logger.error(f"Intent cache redis write error key={key}: {e}")
@@ -19,3 +19,19 @@ class IntentHttp(HttpSource):
             data={"text": text},
         )
         return NERResponse.model_validate(result)
+
+    async def get_intents(self, texts: list[str]) -> list[IntentResponse]:
+        result: dict = await self.post(
+            url=f"{settings.INTENT_API_URL}/intent/batch",
+            headers={},
+            data={"texts": texts},
+        )
+        return [IntentResponse.model_validate(item) for item in result["results"]]
+
+    async def get_ners(self, texts: list[str]) -> list[NERResponse]:
+        result: dict = await self.post(
+            url=f"{settings.INTENT_API_URL}/ner/batch",
+            headers={},
+            data={"texts": texts},
+        )
+        return [NERResponse.model_validate(item) for item in result["results"]]
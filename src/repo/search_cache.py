@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+from redis.asyncio import Redis
+
+from config.config import settings
+from src.json import json
+from src.repo.search_http import SearchHttp
+from src.utils.local_cache import SizedLRUCache
+from src.utils.metrics import metrics
+from src.utils.pools import redis_pool
+from src.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class CachedSearchHttp:
+    """
+    Stale-while-revalidate cache around the search client.
+
+    Results younger than `fresh_ttl` are returned as is. Results younger than
+    `stale_ttl` are returned immediately and refreshed in the background.
+    The optional Redis tier shares results between pods.
+    """
+
+    def __init__(
+        self,
+        http: SearchHttp,
+        fresh_ttl: int = settings.SEARCH_CACHE_FRESH_TTL,
+        stale_ttl: int = settings.SEARCH_CACHE_STALE_TTL,
+        maxsize: int = settings.SEARCH_CACHE_MAXSIZE,
+        max_bytes: int = settings.SEARCH_CACHE_MAX_BYTES,
+        use_redis: bool = settings.SEARCH_CACHE_REDIS,
+        redis_key: str = "search_cache",
+    ):
+        self.http = http
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.local = SizedLRUCache(maxsize=maxsize, max_bytes=max_bytes)
+        self.redis_key = redis_key
+        self.redis: Redis | None = None
+        if use_redis:
+            self.redis = Redis(
+                connection_pool=redis_pool(redis_key, timeout=1, socket_timeout=1)
+            )
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self.flight = SingleFlight("search")
+
+        self.hits = metrics.counter("search_cache_hits", "Fresh search cache hits")
+        self.stale_hits = metrics.counter(
+            "search_cache_stale_hits", "Stale search cache hits"
+        )
+        self.misses = metrics.counter("search_cache_misses", "Search cache misses")
+        metrics.gauge(
+            "search_cache_bytes",
+            "Local search cache size",
+            func=lambda: self.local.bytes,
+        )
+
+    def _get_key(self, params: dict, limit: int) -> str:
+        canonical = json.dumpb(
+            {"params": {k: params[k] for k in sorted(params)}, "limit": limit}
+        )
+        return hashlib.blake2b(canonical, digest_size=16).hexdigest()
+
+    async def search(self, params: dict, limit: int = 100) -> list[dict]:
+        key = self._get_key(params, limit)
+
+        entry = self.local.get(key)
+        if entry is None:
+            entry = await self._get_from_redis(key)
+
+        if entry is not None:
+            results, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.fresh_ttl:
+                self.hits.inc()
+                return results
+            if age < self.stale_ttl:
+                self.stale_hits.inc()
+                self._refresh(key, params, limit)
+                return results
+
+        self.misses.inc()
+        return await self._fetch(key, params, limit)
+
+    async def _fetch(self, key: str, params: dict, limit: int) -> list[dict]:
+        return await self.flight.do(key, lambda: self._fetch_once(key, params, limit))
+
+    async def _fetch_once(self, key: str, params: dict, limit: int) -> list[dict]:
+        results = await self.http.search(params=params, limit=limit)
+        stored_at = time.time()
+        raw = json.dumpb([results, stored_at])
+        self.local.set(key, results, size=len(raw), stored_at=stored_at)
+        await self._save_to_redis(key, raw)
+        return results
+
+    def _refresh(self, key: str, params: dict, limit: int) -> None:
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._fetch(key, params, limit))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda t: self._on_refreshed(key, t))
+
+    def _on_refreshed(self, key: str, task: asyncio.Task) -> None:
+        self._refreshing.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Search cache refresh failed key={key}: {task.exception()}")
+
+    async def _get_from_redis(self, key: str) -> tuple[list[dict], float] | None:
+        if self.redis is None:
+            return None
+        try:
+            raw = await self.redis.get(f"{self.redis_key}:{key}")
+            if raw is None:
+                return None
+            results, stored_at = json.loads(raw)
+            self.local.set(key, results, size=len(raw), stored_at=stored_at)
+            return results, stored_at
+        except Exception as e:
+            logger.error(f"Search cache redis read error key={key}: {e}")
+            return None
+
+    async def _save_to_redis(self, key: str, raw: bytes) -> None:
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(f"{self.redis_key}:{key}", raw, ex=self.stale_ttl)
+        except Exception as e:
+            logger.error(f"Search cache redis write error key={key}: {e}")
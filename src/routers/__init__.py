@@ -1,8 +1,10 @@
 from fastapi import APIRouter
 from .chat import router as _chat_router
 from .history import router as _history_router
+from .metrics import router as _metrics_router
 
 
 router = APIRouter()
 router.include_router(_chat_router, prefix="/chat", tags=["Chat"])
 router.include_router(_history_router, prefix="/history", tags=["History"])
+router.include_router(_metrics_router, prefix="/metrics", tags=["Metrics"])
@@ -13,10 +13,14 @@ async def get_history(
     user_id: str = Query(description="user id"),
     limit: int = Query(default=10),
     offset: int = Query(default=0),
+    before: str | None = Query(
+        default=None, description="`next_cursor` of the previous page"
+    ),
 ) -> HistoryModel:
     service: UserHistory = request.app.state.user_history
     return await service.get(
         user_id=user_id,
         limit=limit,
         offset=offset,
+        before=before,
     )
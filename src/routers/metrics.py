@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+
+from src.utils.metrics import metrics
+
+
+router = APIRouter()
+
+
+@router.get("")
+async def get_metrics() -> dict:
+    return metrics.snapshot()
@@ -12,3 +12,6 @@ class ChatItem(BaseModel):
 class HistoryModel(BaseModel):
     data: list[ChatItem] = Field(description="Users question")
     fields: dict = Field(description="Field fields", default={})
+    next_cursor: str | None = Field(
+        description="`before` cursor of the next (older) page", default=None
+    )
@@ -1,10 +1,20 @@
-from datetime import datetime, UTC
+from datetime import datetime, timedelta, UTC
 import logging
-from src.repo.history import get_user_messages_paginated
+
+from config.config import settings
+from src.repo.history import (
+    encode_cursor,
+    HistoryRow,
+    get_user_history_rows,
+    get_user_messages_before,
+    get_user_messages_paginated,
+)
 from src.schema.history import HistoryModel, ChatItem
+from src.service.history_buffer import ChatRecord, HistoryBuffer, PromptContext
 from src.utils.singleton import SingletonMeta
 from src.utils.cache import SafeLRUCache
-from src.db import get_session
+from src.utils.single_flight import SingleFlight
+from src.db import run_read
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +25,7 @@ class UserHistory(metaclass=SingletonMeta):
         cache: SafeLRUCache,
     ):
         self.cache = cache
+        self.flight = SingleFlight("history_db")
 
     def _get_key(self, user_id: str) -> str:
         return f"{user_id}"
@@ -24,50 +35,149 @@ class UserHistory(metaclass=SingletonMeta):
         user_id: str,
         limit: int = 10,
         offset: int = 0,
+        before: str | None = None,
     ) -> HistoryModel:
+        if before is not None or (offset == 0 and limit > settings.HISTORY_BUFFER_SIZE):
+            # pages the cached buffer can not hold are read without caching
+            messages, next_cursor = await self.flight.do(
+                (user_id, limit, before),
+                lambda: self._get_page_from_db(
+                    user_id=user_id, limit=limit, before=before
+                ),
+            )
+            return HistoryModel(data=messages, next_cursor=next_cursor)
+
+        if offset == 0:
+            buffer = await self._get_buffer(user_id=user_id, limit=limit)
+            buffer = buffer or HistoryBuffer()
+            history = buffer.to_model(limit=limit)
+            if history.data and len(history.data) == limit:
+                # cached records have no ids, the cursor compares the time only
+                history.next_cursor = encode_cursor(history.data[0].assistant_send_at)
+                return history
+            if settings.HISTORY_RECENT_DAYS is None:
+                return history
+            # the buffer holds only recent turns, older ones may still exist
+            messages, next_cursor = await self.flight.do(
+                (user_id, limit, None),
+                lambda: self._get_page_from_db(
+                    user_id=user_id, limit=limit, before=None
+                ),
+            )
+            return HistoryModel(data=messages, next_cursor=next_cursor)
+
+        messages = await self.flight.do(
+            (user_id, limit, offset),
+            lambda: self._get_from_db(user_id=user_id, limit=limit, offset=offset),
+        )
+        return HistoryModel(data=list(messages))
+
+    async def get_context(self, user_id: str) -> PromptContext:
+        buffer = await self._get_buffer(user_id=user_id)
+        return (buffer or HistoryBuffer()).context
+
+    async def _get_buffer(self, user_id: str, limit: int = 10) -> HistoryBuffer | None:
+        """Buffer of the user, None when it is not cached and the DB failed"""
         key = self._get_key(user_id=user_id)
 
-        model = await self.cache.get(key=key)
-        if model and offset == 0:
-            data = HistoryModel.model_validate(model)
-            if len(data.data) >= limit or limit == 10:
-                return HistoryModel(
-                    data=data.data[-limit:],
-                )
+        buffer: HistoryBuffer | None = await self.cache.get(key=key)
+        if buffer is not None and (len(buffer) >= limit or limit == 10):
+            return buffer
+
+        rows = await self.flight.do(
+            (user_id, limit, 0),
+            lambda: self._get_rows_from_db(
+                user_id=user_id, limit=limit, since=self._recent_since()
+            ),
+        )
+        if rows is None:
+            # a shorter cached buffer is better than none
+            return buffer
+        buffer = HistoryBuffer.from_rows(rows)
+        if rows:
+            await self.cache.set(key=key, value=buffer)
+        return buffer
+
+    @staticmethod
+    def _recent_since() -> datetime | None:
+        """Lower time bound of cache fills, lets Postgres skip old partitions"""
+        if settings.HISTORY_RECENT_DAYS is None:
+            return None
+        return datetime.now(UTC) - timedelta(days=settings.HISTORY_RECENT_DAYS)
 
+    async def _get_from_db(
+        self,
+        user_id: str,
+        limit: int,
+        offset: int,
+    ) -> list[ChatItem]:
         logger.info("DATA FROM DB")
-        messages: list[ChatItem] = []
         try:
-            async for session in get_session():
-                messages = await get_user_messages_paginated(
+            return await run_read(
+                lambda session: get_user_messages_paginated(
                     session=session,
                     user_id=user_id,
                     limit=limit,
                     offset=offset,
                 )
+            )
         except Exception as e:
             logger.error(f"Error fetching data from db {user_id=}: {e}", exc_info=True)
+            return []
 
-        data = HistoryModel(data=messages)
-        if offset == 0 and messages:
-            await self.cache.set(key=key, value=data.model_dump())
+    async def _get_rows_from_db(
+        self,
+        user_id: str,
+        limit: int,
+        since: datetime | None = None,
+    ) -> list[HistoryRow] | None:
+        """Latest rows of the user, None when the database could not be read"""
+        logger.info("DATA FROM DB")
+        try:
+            return await run_read(
+                lambda session: get_user_history_rows(
+                    session=session,
+                    user_id=user_id,
+                    limit=limit,
+                    since=since,
+                )
+            )
+        except Exception as e:
+            logger.error(f"Error fetching data from db {user_id=}: {e}", exc_info=True)
+            return None
 
-        return data
+    async def _get_page_from_db(
+        self,
+        user_id: str,
+        limit: int,
+        before: str | None,
+    ) -> tuple[list[ChatItem], str | None]:
+        return await run_read(
+            lambda session: get_user_messages_before(
+                session=session,
+                user_id=user_id,
+                limit=limit,
+                before=before,
+            )
+        )
 
     async def update(
         self,
         user_id: str,
         answer: str,
         question: str,
-    ) -> HistoryModel:
-        model = await self.get(user_id=user_id)
-        model.data.append(
-            ChatItem(
-                user=question,
-                assistant=answer,
-                assistant_send_at=datetime.now(UTC),
-            )
+    ) -> None:
+        buffer = await self._get_buffer(user_id=user_id)
+        record = ChatRecord(
+            user=question,
+            assistant=answer,
+            assistant_send_at=datetime.now(UTC),
         )
         key = self._get_key(user_id=user_id)
-        logger.info("SET NEW")
-        await self.cache.set(key=key, value=model.model_dump(mode="json"))
+        # only the new turn goes to Redis and peers when the buffer is cached
+        if not await self.cache.append(key=key, item=record):
+            if buffer is None:
+                # caching only the new turn would hide the history in the DB
+                return
+            buffer.append(record)
+            await self.cache.set(key=key, value=buffer)
@@ -0,0 +1,131 @@
+from collections import deque
+from collections.abc import Iterable
+from datetime import datetime
+from typing import Any
+
+from config.config import settings
+from src.schema.history import ChatItem, HistoryModel
+
+
+class ChatRecord:
+    __slots__ = ("assistant", "assistant_send_at", "user")
+
+    def __init__(self, user: str, assistant: str, assistant_send_at: datetime):
+        self.user = user
+        self.assistant = assistant
+        self.assistant_send_at = assistant_send_at
+
+
+class PromptContext:
+    """
+    Latest user utterances joined by newlines, the history part of the text
+    sent to `/intent` and `/ner`. Keeps at most `window` utterances and
+    `max_chars` characters, the oldest are dropped first.
+    """
+
+    __slots__ = ("max_chars", "text", "utterances", "window")
+
+    def __init__(
+        self,
+        window: int = settings.CHAT_CONTEXT_WINDOW,
+        max_chars: int = settings.CHAT_CONTEXT_MAX_CHARS,
+    ):
+        self.window = window
+        self.max_chars = max_chars
+        self.utterances: deque[str] = deque()
+        self.text = ""
+
+    def append(self, utterance: str) -> None:
+        self.utterances.append(utterance)
+        self.text += f"{utterance}\n"
+        while self.utterances and (
+            len(self.utterances) > self.window or len(self.text) > self.max_chars
+        ):
+            oldest = self.utterances.popleft()
+            self.text = self.text[len(oldest) + 1 :]
+
+    def prompt(self, question: str) -> str:
+        return self.text + question
+
+
+class HistoryBuffer:
+    """
+    Latest chat turns of one user, the value kept in the history cache.
+
+    It is read and appended without pydantic validation and is converted
+    to plain lists only at the Redis boundary (`dump`/`load`). The prompt
+    context is derived from the records and is not stored.
+    """
+
+    __slots__ = ("context", "records")
+
+    def __init__(
+        self,
+        records: Iterable[ChatRecord] = (),
+        capacity: int = settings.HISTORY_BUFFER_SIZE,
+    ):
+        self.records: deque[ChatRecord] = deque(records, maxlen=capacity)
+        self.context = PromptContext()
+        for record in self.last(self.context.window):
+            self.context.append(record.user)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def append(self, record: ChatRecord) -> None:
+        self.records.append(record)
+        self.context.append(record.user)
+
+    def last(self, limit: int) -> list[ChatRecord]:
+        if limit >= len(self.records):
+            return list(self.records)
+        return [
+            self.records[i] for i in range(len(self.records) - limit, len(self.records))
+        ]
+
+    def to_model(self, limit: int) -> HistoryModel:
+        return HistoryModel.model_construct(
+            data=[
+                ChatItem.model_construct(
+                    user=record.user,
+                    assistant=record.assistant,
+                    assistant_send_at=record.assistant_send_at,
+                )
+                for record in self.last(limit)
+            ],
+            fields={},
+        )
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple[str, str, datetime]]) -> "HistoryBuffer":
+        """Builds the buffer straight from `(user, assistant, send_at)` DB rows"""
+        return cls(
+            ChatRecord(user, assistant, send_at) for user, assistant, send_at in rows
+        )
+
+    @staticmethod
+    def dump_record(record: ChatRecord) -> list:
+        return [record.user, record.assistant, record.assistant_send_at.isoformat()]
+
+    @staticmethod
+    def load_record(data: list) -> ChatRecord:
+        user, assistant, send_at = data
+        return ChatRecord(user, assistant, datetime.fromisoformat(send_at))
+
+    @classmethod
+    def dump(cls, buffer: "HistoryBuffer") -> list[list]:
+        return [cls.dump_record(record) for record in buffer.records]
+
+    @classmethod
+    def load(cls, data: Any) -> "HistoryBuffer":
+        if isinstance(data, dict):
+            # `HistoryModel.model_dump()` written by older versions
+            return cls(
+                ChatRecord(
+                    item["user"],
+                    item["assistant"],
+                    datetime.fromisoformat(item["assistant_send_at"]),
+                )
+                for item in data["data"]
+            )
+        return cls(cls.load_record(item) for item in data)
@@ -1,14 +1,20 @@
 import os
+import socket
 import time
 import asyncio
+import heapq
 import uuid
 from collections import OrderedDict
+from collections.abc import Callable
 from typing import Any, Literal
 
-from redis.asyncio import Redis, ConnectionPool
-from src.json import json
+from redis.asyncio import Redis
 
 from config.config import settings
+from src.utils.cache_codec import CacheCodec, get_codec
+from src.utils.metrics import metrics
+from src.utils.pools import redis_pool
+from src.utils.shm_cache import SharedMemoryTable
 from src.utils.singleton import SingletonMeta
 
 import logging
@@ -16,191 +22,1006 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+# Atomically writes the value, bumps the key version and publishes
+# an invalidation (key + version) to the sync stream
+_INVALIDATE_SCRIPT = """
+if ARGV[1] == 'set' then
+    redis.call('ZADD', KEYS[4], ARGV[7], ARGV[2])
+    redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+else
+    redis.call('ZREM', KEYS[4], ARGV[2])
+    redis.call('HDEL', KEYS[1], ARGV[2])
+end
+local version = redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+redis.call(
+    'XADD', KEYS[3], 'MAXLEN', '~', ARGV[5], '*',
+    'op', ARGV[1], 'key', ARGV[2], 'version', version, 'sender', ARGV[4],
+    'host', ARGV[6]
+)
+return version
+"""
+
+# Same for values kept as capped Redis lists: `set` replaces the list,
+# `append` pushes one item and publishes it with the new version
+_LIST_SCRIPT = """
+if ARGV[1] ~= 'append' then
+    redis.call('DEL', KEYS[1])
+end
+if ARGV[1] == 'delete' then
+    redis.call('ZREM', KEYS[4], ARGV[2])
+else
+    redis.call('ZADD', KEYS[4], ARGV[9], ARGV[2])
+    for i = 10, #ARGV do
+        redis.call('RPUSH', KEYS[1], ARGV[i])
+    end
+    redis.call('LTRIM', KEYS[1], -tonumber(ARGV[5]), -1)
+    redis.call('PEXPIRE', KEYS[1], ARGV[6])
+end
+local version = redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+redis.call(
+    'XADD', KEYS[3], 'MAXLEN', '~', ARGV[4], '*',
+    'op', ARGV[1], 'key', ARGV[2], 'version', version, 'sender', ARGV[3],
+    'value', ARGV[7], 'host', ARGV[8]
+)
+return version
+"""
+
+# Removes the fields of keys last written before ARGV[1] from the storage
+# and versions hashes. Writers add a key to the expiry set before they
+# write its value, so a value written after the check is never removed.
+_EXPIRE_SCRIPT = """
+local keys = redis.call(
+    'ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2]
+)
+if #keys > 0 then
+    redis.call('HDEL', KEYS[2], unpack(keys))
+    redis.call('HDEL', KEYS[3], unpack(keys))
+    redis.call('ZREM', KEYS[1], unpack(keys))
+end
+return #keys
+"""
+
+
+_Op = Literal["set", "delete", "append"]
+
+
+class _CacheEntry:
+    __slots__ = ("value", "timestamp", "size", "version")
+
+    def __init__(self, value: Any, timestamp: float, size: int, version: int = 0):
+        self.value = value
+        self.timestamp = timestamp
+        self.size = size
+        self.version = version
+
+
 class SafeLRUCache(metaclass=SingletonMeta):
-    def __init__(self, max_age: int, maxsize: int, redis_key="lru_cache"):
-        self.cache: OrderedDict[str | int, Any] = OrderedDict()
+    """
+    LRU cache synced between pods through Redis.
+
+    Memory (a per-process dict or a `SharedMemoryTable` of the host) is the
+    first tier and Redis the second one. Writes go to Redis in batches and
+    peers apply them from a Redis stream.
+    """
+
+    def __init__(
+        self,
+        max_age: int,
+        maxsize: int,
+        max_bytes: int = 256 * 1024 * 1024,
+        sweep_interval: float = 5.0,
+        redis_sweep_interval: float = 60.0,
+        redis_key="lru_cache",
+        sync_chunk_size: int = 50,
+        sync_batch_size: int = 500,
+        stream_maxlen: int = 1000,
+        replication: Literal["push", "invalidate"] = "push",
+        warmup_keys: int = 1000,
+        write_batch_size: int = 500,
+        write_batch_delay: float = 0.0,
+        codec: CacheCodec | None = None,
+        shared: SharedMemoryTable | None = None,
+        value_dump: Callable[[Any], Any] | None = None,
+        value_load: Callable[[Any], Any] | None = None,
+        list_capacity: int | None = None,
+        item_dump: Callable[[Any], Any] | None = None,
+        item_load: Callable[[Any], Any] | None = None,
+    ):
+        self.cache: OrderedDict[str | int, _CacheEntry] = OrderedDict()
         self.max_age = max_age
         self.maxsize = maxsize
-        self.lock = asyncio.Lock()
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.sweep_interval = sweep_interval
+        self.redis_sweep_interval = redis_sweep_interval
+        self._redis_swept_at = 0.0
+        self._expiry_heap: list[tuple[float, str | int, float]] = []
+        self.sync_chunk_size = sync_chunk_size
+        self.sync_batch_size = sync_batch_size
+        self.stream_maxlen = stream_maxlen
+        self.replication = replication
+        self.warmup_keys = warmup_keys
+        self._pending_reads: dict[str | int, asyncio.Future] = {}
+        self._read_tasks: set[asyncio.Task] = set()
+        self.write_batch_size = write_batch_size
+        self.write_batch_delay = write_batch_delay
+        self.codec = codec or get_codec(
+            settings.CACHE_CODEC,
+            compression=settings.CACHE_COMPRESSION,
+            compress_threshold=settings.CACHE_COMPRESS_THRESHOLD,
+        )
+        self.shared = shared
+        self.value_dump = value_dump
+        self.value_load = value_load
+        self.list_capacity = list_capacity
+        self.item_dump = item_dump
+        self.item_load = item_load
         self.instance_id = self.__generate_instance_id()
+        self._host = self.host_id.encode()
 
-        redis_pool = ConnectionPool.from_url(
-            url=settings.REDIS_URL,
-            max_connections=5,
+        pool = redis_pool(
+            redis_key,
             socket_timeout=30,
             db=0,
             encoding="utf-8",
             socket_connect_timeout=20,
             health_check_interval=30,
             retry_on_timeout=True,
-            decode_responses=True,
+            decode_responses=False,
         )
-        self.redis = Redis(connection_pool=redis_pool)
+        self.redis = Redis(connection_pool=pool)
         self.redis_storage_key = f"{redis_key}_storage"
         self.redis_stream_key = f"{redis_key}_stream"
+        self.redis_versions_key = f"{redis_key}_versions"
+        self.redis_recent_key = f"{redis_key}_recent"
+        self.redis_expiry_key = f"{redis_key}_expiry"
+        self.redis_list_prefix = f"{redis_key}_list:"
+        self._invalidate_script = self.redis.register_script(_INVALIDATE_SCRIPT)
+        self._list_script = self.redis.register_script(_LIST_SCRIPT)
+        self._expire_script = self.redis.register_script(_EXPIRE_SCRIPT)
 
         self.stop_event = asyncio.Event()
 
-        self.task_queue: asyncio.Queue[
-            tuple[Literal["set", "delete"], str | int, Any | None]
-        ] = asyncio.Queue()
+        self.task_queue: asyncio.Queue[tuple[_Op, str | int, Any | None]] = (
+            asyncio.Queue()
+        )
+
+        metrics.gauge(
+            "cache_write_queue_depth",
+            "Redis ops waiting in the write-behind queue",
+            func=self.task_queue.qsize,
+        )
+        self.flush_latency = metrics.histogram(
+            "cache_write_flush_seconds", "Write-behind pipeline latency"
+        )
+        self.flush_size = metrics.histogram(
+            "cache_write_flush_size",
+            "Ops per write-behind pipeline",
+            buckets=(1, 5, 10, 50, 100, 500, 1000),
+        )
+        self.collapsed_ops = metrics.counter(
+            "cache_write_collapsed_ops", "Ops dropped by last-write-wins"
+        )
+        self.appends = metrics.counter(
+            "cache_appends", "Values updated by appending one item"
+        )
+
+        metrics.gauge(
+            "cache_resident_bytes",
+            "Encoded size of cached values",
+            func=lambda: self.bytes,
+        )
+        metrics.gauge("cache_entries", "Cached entries", func=self._entries_count)
+        self.evictions = metrics.counter("cache_evictions", "Entries evicted by size")
+        self.expirations = metrics.counter("cache_expirations", "Entries expired")
+        self.redis_expirations = metrics.counter(
+            "cache_redis_expirations", "Expired fields removed from the Redis hashes"
+        )
+        self.sync_lag = metrics.gauge(
+            "cache_sync_lag_seconds", "Age of the last applied stream message"
+        )
+        self.l2_hits = metrics.counter("cache_l2_hits", "Memory misses found in Redis")
+        self.l2_misses = metrics.counter(
+            "cache_l2_misses", "Misses in memory and Redis"
+        )
+        self.read_batch_size = metrics.histogram(
+            "cache_l2_read_batch_size",
+            "Keys per read-through HMGET",
+            buckets=(1, 2, 5, 10, 50, 100),
+        )
+        self.sync_gaps = metrics.counter(
+            "cache_sync_gaps", "Resyncs after the stream was trimmed past this pod"
+        )
 
         loop = asyncio.get_running_loop()
-        loop.create_task(self._load_all_from_redis())
+        self.task_warm_up = loop.create_task(self._warm_up())
+        self.task_sweep = loop.create_task(self._sweep_loop())
 
         self.task_sync = loop.create_task(self._background_sync())
         self.task_worker = loop.create_task(self._worker_loop())
 
+    @property
+    def host_id(self) -> str:
+        return os.getenv("HOSTNAME") or socket.gethostname()
+
     def __generate_instance_id(self):
-        pod_name = os.getenv("HOSTNAME", "unknownpod")
+        pod_name = self.host_id
         pid = os.getpid()
         random_part = str(uuid.uuid4())
         timestamp = int(time.time() * 1e6) % 1000
         return f"{pod_name}-{pid}-{random_part}-{timestamp}"
 
-    async def _load_all_from_redis(self):
+    def _encode(self, value: Any, timestamp: float) -> bytes:
+        # `value_dump`/`value_load` convert native objects at the Redis boundary
+        if self.value_dump is not None:
+            value = self.value_dump(value)
+        return self.codec.encode(value, timestamp)
+
+    def _decode(self, raw: bytes) -> tuple[Any, float]:
+        value, timestamp = self.codec.decode(raw)
+        if self.value_load is not None:
+            value = self.value_load(value)
+        return value, timestamp
+
+    def _decode_items(self, raw_items: list[bytes]) -> tuple[Any, float]:
+        """Builds a value from the items of its Redis list"""
+        items = []
+        timestamp = 0.0
+        for raw_item in raw_items:
+            item, item_timestamp = self.codec.decode(raw_item)
+            items.append(item)
+            timestamp = max(timestamp, item_timestamp)
+        if self.value_load is not None:
+            return self.value_load(items), timestamp
+        return items, timestamp
+
+    def _list_key(self, key: str | int) -> str:
+        return f"{self.redis_list_prefix}{key}"
+
+    def _entries_count(self) -> int:
+        if self.shared is not None:
+            if self.stop_event.is_set():
+                return 0
+            return self.shared.used()
+        return len(self.cache)
+
+    def _is_syncer(self) -> bool:
+        """
+        With `shared` only the worker holding the host syncer lock reads the
+        stream, warms up and sweeps, the others see its writes in the table.
+        """
+        return self.shared is None or self.shared.try_become_syncer()
+
+    async def _warm_up(self) -> None:
+        """Loads only the most recently written keys, not the whole hash"""
+        if not self.warmup_keys or not self._is_syncer():
+            return
         try:
-            cursor = 0
-            while True:
-                cursor, data = await self.redis.hscan(
-                    self.redis_storage_key, cursor=cursor, count=100
-                )
-                async with self.lock:
-                    now = time.time()
-                    for key, raw_val in data.items():
-                        try:
-                            value, timestamp = json.loads(raw_val)
-                            if now - timestamp < self.max_age:
-                                self.cache[key] = (value, timestamp)
-                        except Exception as e:
-                            logger.error(f"JSON decode error on key={key}: {e}")
-                if cursor == 0:
-                    break
+            raw_keys = await self.redis.zrevrange(
+                self.redis_recent_key, 0, self.warmup_keys - 1
+            )
+            keys = [raw_key.decode() for raw_key in raw_keys]
+            for start in range(0, len(keys), self.sync_batch_size):
+                await self._fetch_from_redis(keys[start : start + self.sync_batch_size])
         except Exception as e:
-            logger.error(f"Redis HSCAN load error: {e}")
+            logger.error(f"Redis warm up error: {e}")
 
-    async def _save_item_to_redis(self, key: str | int, value: Any) -> None:
-        packed_value = json.dumps([value, time.time()])
-        await self.task_queue.put(("set", key, packed_value))
+    async def _fetch_from_redis(self, keys: list[str | int]) -> list[Any | None]:
+        """Reads keys from Redis into memory and returns their values"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if self.list_capacity:
+                for key in keys:
+                    await pipe.lrange(self._list_key(key), -self.list_capacity, -1)
+            else:
+                await pipe.hmget(self.redis_storage_key, keys)
+            await pipe.hmget(self.redis_versions_key, keys)
+            *raw_values, raw_versions = await pipe.execute()
+        if not self.list_capacity:
+            raw_values = raw_values[0]
 
-    async def _delete_item_from_redis(self, key: str | int) -> None:
-        await self.task_queue.put(("delete", key, None))
+        now = time.time()
+        values: list[Any | None] = []
+        for key, raw_val, raw_version in zip(keys, raw_values, raw_versions):
+            value = None
+            if raw_val:
+                try:
+                    if self.list_capacity:
+                        value, timestamp = self._decode_items(raw_val)
+                        raw, size = None, sum(len(item) for item in raw_val)
+                    else:
+                        value, timestamp = self._decode(raw_val)
+                        raw, size = raw_val, len(raw_val)
+                    if now - timestamp < self.max_age:
+                        value = self._apply_remote_set(
+                            key, value, timestamp, size, int(raw_version or 0), raw
+                        )
+                    else:
+                        value = None
+                except Exception as e:
+                    logger.error(f"Decode error on key={key}: {e}")
+                    value = None
+            values.append(value)
+        return values
 
-    async def _worker_loop(self):
+    async def _read_through(self, key: str | int) -> Any | None:
+        """
+        Reads a key missing in memory from Redis. Misses of the same loop
+        iteration are sent as one HMGET.
+        """
+        future = self._pending_reads.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending_reads[key] = future
+            if len(self._pending_reads) == 1:
+                loop.call_soon(self._start_read_batch)
+        return await asyncio.shield(future)
+
+    def _start_read_batch(self) -> None:
+        pending, self._pending_reads = self._pending_reads, {}
+        task = asyncio.create_task(self._read_batch(pending))
+        self._read_tasks.add(task)
+        task.add_done_callback(self._read_tasks.discard)
+
+    async def _read_batch(self, pending: dict[str | int, asyncio.Future]) -> None:
+        self.read_batch_size.observe(len(pending))
+        try:
+            values = await self._fetch_from_redis(list(pending))
+        except Exception as e:
+            logger.error(f"Redis read error on {len(pending)} keys: {e}")
+            values = [None] * len(pending)
+
+        for future, value in zip(pending.values(), values):
+            if value is None:
+                self.l2_misses.inc()
+            else:
+                self.l2_hits.inc()
+            if not future.done():
+                future.set_result(value)
+
+    def _apply_remote_set(
+        self,
+        key: str | int,
+        value: Any,
+        timestamp: float,
+        size: int,
+        version: int = 0,
+        raw: bytes | None = None,
+    ) -> Any:
+        """Stores a value from Redis unless memory has a newer one"""
+        if self.shared is not None:
+            if raw is None:
+                raw = self._encode(value, timestamp)
+            self.shared.set(str(key), raw, timestamp, if_newer=True)
+            return value
+
+        current = self.cache.get(key)
+        if current is not None and current.timestamp >= timestamp:
+            current.version = max(current.version, version)
+            return current.value
+        self._store(key, value, timestamp, size, version, raw)
+        return value
+
+    def _apply_remote_append(
+        self, key: str | int, raw_item: bytes, version: int = 0
+    ) -> bool:
+        """
+        Adds an item appended by a peer to the local copy. Returns False
+        when there is no copy it can be applied to.
+        """
+        item, timestamp = self.codec.decode(raw_item)
+        if self.item_load is not None:
+            item = self.item_load(item)
+
+        if self.shared is not None:
+            # the table keeps no versions, only `push` mode appends are applied
+            current = self.shared.get(str(key))
+            if version or current is None:
+                return False
+            value, _ = self._decode(current[0])
+            value.append(item)
+            self.shared.set(str(key), self._encode(value, timestamp), timestamp)
+            return True
+
+        entry = self.cache.get(key)
+        if entry is None or (version and entry.version != version - 1):
+            return False
+        self._append_to_entry(key, entry, item, len(raw_item), timestamp)
+        entry.version = max(entry.version, version)
+        return True
+
+    def _append_to_entry(
+        self,
+        key: str | int,
+        entry: _CacheEntry,
+        item: Any,
+        item_size: int,
+        timestamp: float,
+    ) -> None:
+        length = len(entry.value)
+        entry.value.append(item)
+        if length and len(entry.value) == length:
+            # the oldest item fell out of a capped value
+            item_size -= entry.size // length
+        entry.size += item_size
+        self.bytes += item_size
+        if timestamp > entry.timestamp:
+            entry.timestamp = timestamp
+            heapq.heappush(
+                self._expiry_heap, (timestamp + self.max_age, key, timestamp)
+            )
+        self.cache.move_to_end(key)
+        self._evict()
+
+    def _store(
+        self,
+        key: str | int,
+        value: Any,
+        timestamp: float,
+        size: int,
+        version: int = 0,
+        raw: bytes | None = None,
+    ) -> None:
+        """Puts entry to the memory, evicting old entries to free space"""
+        if self.shared is not None:
+            if raw is None:
+                raw = self._encode(value, timestamp)
+            self.shared.set(str(key), raw, timestamp)
+            return
+
+        self._drop(key)
+        self.cache[key] = _CacheEntry(value, timestamp, size, version)
+        self.bytes += size
+        heapq.heappush(self._expiry_heap, (timestamp + self.max_age, key, timestamp))
+        self._evict()
+
+    def _evict(self) -> None:
+        """
+        Keeps memory within `maxsize` entries and `max_bytes` of encoded
+        values. Local only: Redis and the peers keep their copies.
+        """
+        while len(self.cache) > 1 and (
+            len(self.cache) > self.maxsize or self.bytes > self.max_bytes
+        ):
+            _, old_entry = self.cache.popitem(last=False)
+            self.bytes -= old_entry.size
+            self.evictions.inc()
+
+    def _drop(self, key: str | int) -> None:
+        if self.shared is not None:
+            self.shared.delete(str(key))
+            return
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    async def _sweep_loop(self):
         while not self.stop_event.is_set():
+            await asyncio.sleep(self.sweep_interval)
             try:
-                task = await self.task_queue.get()
-            except asyncio.QueueEmpty:
-                continue
+                await self._sweep()
+                if time.time() - self._redis_swept_at >= self.redis_sweep_interval:
+                    await self._sweep_redis()
+            except Exception as e:
+                logger.error(f"Cache sweep error: {e}")
 
-            op, key, value = task
-            logger.info(
-                "NEW ACTION",
-                extra={
-                    "op": op,
-                    "key": key,
-                    "from": self.instance_id,
-                },
+    async def _sweep(self) -> None:
+        """Removes expired entries in bulk, not only when `get` finds them"""
+        now = time.time()
+        if self.shared is not None:
+            if self.shared.is_syncer:
+                self.expirations.inc(self.shared.expire(now - self.max_age))
+            return
+
+        heap = self._expiry_heap
+        expired = 0
+        while heap and heap[0][0] <= now:
+            _, key, timestamp = heapq.heappop(heap)
+            entry = self.cache.get(key)
+            # the heap keeps outdated records of overwritten entries
+            if entry is not None and entry.timestamp == timestamp:
+                self._drop(key)
+                expired += 1
+                if expired % self.sync_chunk_size == 0:
+                    await asyncio.sleep(0)
+        self.expirations.inc(expired)
+
+        if len(heap) > 2 * len(self.cache) + 1000:
+            self._expiry_heap = [
+                (entry.timestamp + self.max_age, key, entry.timestamp)
+                for key, entry in self.cache.items()
+            ]
+            heapq.heapify(self._expiry_heap)
+
+    async def _sweep_redis(self) -> None:
+        """
+        Removes values and versions of keys not written for `max_age` from
+        Redis. Otherwise the hash keeps every key ever cached: `get` deletes
+        only the expired values it happens to read.
+        """
+        self._redis_swept_at = time.time()
+        if not self._is_syncer():
+            return
+        cutoff = self._redis_swept_at - self.max_age
+        while not self.stop_event.is_set():
+            removed = await self._expire_script(
+                keys=[
+                    self.redis_expiry_key,
+                    self.redis_storage_key,
+                    self.redis_versions_key,
+                ],
+                args=[cutoff, self.sync_batch_size],
             )
-            pipe = self.redis.pipeline()
+            self.redis_expirations.inc(removed)
+            if removed < self.sync_batch_size:
+                return
+
+    def _save_item_to_redis(self, key: str | int, packed_value: Any) -> None:
+        self.task_queue.put_nowait(("set", key, packed_value))
+
+    def _append_item_to_redis(self, key: str | int, packed_item: bytes) -> None:
+        self.task_queue.put_nowait(("append", key, packed_item))
+
+    def _delete_item_from_redis(self, key: str | int) -> None:
+        self.task_queue.put_nowait(("delete", key, None))
+
+    async def _worker_loop(self):
+        """
+        Sends queued writes in one pipeline: everything queued, up to
+        `write_batch_size` ops, waiting at most `write_batch_delay` for more.
+        """
+        loop = asyncio.get_running_loop()
+        while not self.stop_event.is_set():
+            batch = [await self.task_queue.get()]
+            deadline = loop.time() + self.write_batch_delay
+            while len(batch) < self.write_batch_size:
+                try:
+                    batch.append(self.task_queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.task_queue.get(), timeout))
+                except TimeoutError:
+                    break
+
             try:
-                await pipe.reset()
-                if op == "set":
-                    await pipe.hset(self.redis_storage_key, key, value)
-                elif op == "delete":
-                    await pipe.hdel(self.redis_storage_key, key)
-                await pipe.xadd(
-                    self.redis_stream_key,
-                    {
-                        "op": op,
-                        "key": key,
-                        "value": value or "",
-                        "sender": self.instance_id,
-                    },
-                    maxlen=1000,
-                    approximate=True,
-                )
-                await pipe.execute()
-            except Exception as e:
-                logger.error(f"Redis worker error on {op} key={key}: {e}")
+                await self._flush_ops(batch)
             finally:
-                self.task_queue.task_done()
+                for _ in batch:
+                    self.task_queue.task_done()
+
+    async def _flush_ops(self, batch: list[tuple[_Op, str | int, Any | None]]) -> None:
+        # a set or delete replaces the ops queued before it for the key,
+        # appends are kept in order; a key keeps the position of its latest op
+        pending: dict[str | int, list[tuple[_Op, Any | None]]] = {}
+        for op, key, value in batch:
+            ops = pending.pop(key, [])
+            if op != "append":
+                ops = []
+            ops.append((op, value))
+            pending[key] = ops
+        flushed = sum(len(ops) for ops in pending.values())
+        self.collapsed_ops.inc(len(batch) - flushed)
+
+        if self.replication == "invalidate":
+            await self._flush_invalidations(pending, flushed)
+            return
+
+        started = time.perf_counter()
+        pipe = self.redis.pipeline(transaction=False)
+        try:
+            await self._track_expiry(pipe, pending)
+            if self.list_capacity:
+                await self._write_lists(pipe, pending)
+            else:
+                await self._write_hash(pipe, pending)
+            await self._track_recent(pipe, pending)
+            for key, ops in pending.items():
+                for op, value in ops:
+                    if isinstance(value, tuple):
+                        # list mode `set`: (whole value, list items)
+                        value = value[0]
+                    await pipe.xadd(
+                        self.redis_stream_key,
+                        {
+                            "op": op,
+                            "key": key,
+                            "value": value or b"",
+                            "sender": self.instance_id,
+                            "host": self._host,
+                        },
+                        maxlen=self.stream_maxlen,
+                        approximate=True,
+                    )
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis worker error on batch of {flushed} ops: {e}")
+        finally:
+            await pipe.reset()
+            self.flush_latency.observe(time.perf_counter() - started)
+            self.flush_size.observe(flushed)
+
+    async def _write_hash(
+        self, pipe, pending: dict[str | int, list[tuple[_Op, Any | None]]]
+    ) -> None:
+        to_set = {
+            key: ops[-1][1] for key, ops in pending.items() if ops[-1][0] == "set"
+        }
+        to_delete = [key for key, ops in pending.items() if ops[-1][0] == "delete"]
+        if to_set:
+            await pipe.hset(self.redis_storage_key, mapping=to_set)
+        if to_delete:
+            await pipe.hdel(self.redis_storage_key, *to_delete)
+
+    async def _write_lists(
+        self, pipe, pending: dict[str | int, list[tuple[_Op, Any | None]]]
+    ) -> None:
+        """
+        With `list_capacity` values are capped Redis lists
+        (`{redis_key}_list:{key}`) and an append pushes only the new item.
+        """
+        ttl_ms = int(self.max_age * 1000)
+        for key, ops in pending.items():
+            list_key = self._list_key(key)
+            for op, value in ops:
+                if op != "append":
+                    await pipe.delete(list_key)
+                if op == "set" and value[1]:
+                    await pipe.rpush(list_key, *value[1])
+                elif op == "append":
+                    await pipe.rpush(list_key, value)
+            if ops[-1][0] != "delete":
+                await pipe.ltrim(list_key, -self.list_capacity, -1)
+                await pipe.pexpire(list_key, ttl_ms)
+
+    async def _track_expiry(
+        self, pipe, pending: dict[str | int, list[tuple[_Op, Any | None]]]
+    ) -> None:
+        """
+        Records the write time of every key for `_sweep_redis`. Goes before
+        the writes themselves: a sweep between the two commands sees the new
+        time and keeps the value.
+        """
+        now = time.time()
+        written = {key: now for key, ops in pending.items() if ops[-1][0] != "delete"}
+        deleted = [key for key, ops in pending.items() if ops[-1][0] == "delete"]
+        if written:
+            await pipe.zadd(self.redis_expiry_key, written)
+        if deleted:
+            await pipe.zrem(self.redis_expiry_key, *deleted)
+
+    async def _track_recent(
+        self, pipe, pending: dict[str | int, list[tuple[_Op, Any | None]]]
+    ) -> None:
+        """Keeps a bounded set of recently written keys for the warm up"""
+        if not self.warmup_keys:
+            return
+        now = time.time()
+        written = {key: now for key, ops in pending.items() if ops[-1][0] != "delete"}
+        deleted = [key for key, ops in pending.items() if ops[-1][0] == "delete"]
+        if written:
+            await pipe.zadd(self.redis_recent_key, written)
+        if deleted:
+            await pipe.zrem(self.redis_recent_key, *deleted)
+        await pipe.zremrangebyrank(self.redis_recent_key, 0, -self.warmup_keys - 1)
+
+    async def _flush_invalidations(
+        self, pending: dict[str | int, list[tuple[_Op, Any | None]]], flushed: int
+    ) -> None:
+        """
+        `invalidate` replication: the stream carries only the key and its
+        version from `{redis_key}_versions`, peers drop older copies and read
+        the value on the next `get`.
+        """
+        started = time.perf_counter()
+        pipe = self.redis.pipeline(transaction=False)
+        try:
+            for key, ops in pending.items():
+                for op, value in ops:
+                    await self._invalidate(pipe, op, key, value)
+            await self._track_recent(pipe, pending)
+            versions = iter(await pipe.execute())
+            for key, ops in pending.items():
+                version = max(next(versions) for _ in ops)
+                entry = self.cache.get(key)
+                if entry is not None and entry.version < version:
+                    entry.version = version
+        except Exception as e:
+            logger.error(f"Redis worker error on batch of {flushed} ops: {e}")
+        finally:
+            await pipe.reset()
+            self.flush_latency.observe(time.perf_counter() - started)
+            self.flush_size.observe(flushed)
+
+    async def _invalidate(self, pipe, op: _Op, key: str | int, value: Any) -> None:
+        if not self.list_capacity:
+            await self._invalidate_script(
+                keys=[
+                    self.redis_storage_key,
+                    self.redis_versions_key,
+                    self.redis_stream_key,
+                    self.redis_expiry_key,
+                ],
+                args=[
+                    op,
+                    key,
+                    value or b"",
+                    self.instance_id,
+                    self.stream_maxlen,
+                    self._host,
+                    time.time(),
+                ],
+                client=pipe,
+            )
+            return
+
+        # appended items go with the invalidation, peers can apply them
+        payload, items = b"", []
+        if op == "set":
+            items = value[1]
+        elif op == "append":
+            payload, items = value, [value]
+        await self._list_script(
+            keys=[
+                self._list_key(key),
+                self.redis_versions_key,
+                self.redis_stream_key,
+                self.redis_expiry_key,
+            ],
+            args=[
+                op,
+                key,
+                self.instance_id,
+                self.stream_maxlen,
+                self.list_capacity,
+                int(self.max_age * 1000),
+                payload,
+                self._host,
+                time.time(),
+                *items,
+            ],
+            client=pipe,
+        )
 
     async def _background_sync(self):
+        """
+        Applies peer writes in chunks of `sync_chunk_size` with a yield to
+        the loop between them. Memory is changed without awaits, so readers
+        need no lock and a bulk sync does not stall them.
+        """
+        last_id: bytes | None = None
+        check_gap = False
         while not self.stop_event.is_set():
+            if not self._is_syncer():
+                await asyncio.sleep(1)
+                continue
             try:
+                if last_id is None:
+                    last_id = await self._stream_last_id()
+                if check_gap:
+                    await self._check_gap(last_id)
+                    check_gap = False
+
                 entries = await self.redis.xread(
-                    {self.redis_stream_key: "$"},
-                    count=100,
+                    {self.redis_stream_key: last_id},
+                    count=self.sync_batch_size,
                     block=1000,
                 )
+                if not entries:
+                    self.sync_lag.set(0)
 
                 for _, messages in entries:
-                    async with self.lock:
-                        now = time.time()
-                        for msg_id, fields in messages:
-                            op = fields["op"]
-                            key = fields["key"]
-                            value = fields.get("value")
-                            sender = fields.get("sender")
-                            if sender == self.instance_id:
-                                continue
-
-                            logger.info(
-                                "RECIVE ACTION",
-                                extra={
-                                    "op": op,
-                                    "key": key,
-                                    "to": self.instance_id,
-                                    "from": sender,
-                                },
-                            )
-
-                            try:
-                                if op == "set" and value:
-                                    unpacked_value, timestamp = json.loads(value)
-                                    if now - timestamp < self.max_age:
-                                        self.cache[key] = (unpacked_value, timestamp)
-                                    else:
-                                        self.cache.pop(key, None)
-                                elif op == "delete":
-                                    self.cache.pop(key, None)
-                            except Exception as e:
-                                logger.error(f"Failed to process stream message: {e}")
+                    for start in range(0, len(messages), self.sync_chunk_size):
+                        chunk = messages[start : start + self.sync_chunk_size]
+                        self._apply_stream_messages(chunk)
+                        last_id = chunk[-1][0]
+                        if self.shared is not None:
+                            self.shared.last_stream_id = last_id
+                        await asyncio.sleep(0)
+                    self.sync_lag.set(max(0.0, time.time() - self._id_time(last_id)))
+                    # a full batch means the pod is behind, the stream could be
+                    # trimmed past `last_id` before the next read
+                    check_gap = len(messages) >= self.sync_batch_size
 
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Redis stream read error: {e}")
-                asyncio.sleep(5)
+                check_gap = True
+                await asyncio.sleep(5)
+
+    async def _stream_last_id(self) -> bytes:
+        if self.shared is not None and self.shared.last_stream_id:
+            # continue after the previous syncer of this host
+            return self.shared.last_stream_id
+        entries = await self.redis.xrevrange(self.redis_stream_key, count=1)
+        return entries[0][0] if entries else b"0-0"
+
+    async def _check_gap(self, last_id: bytes) -> None:
+        """Resyncs the cached keys when the stream was trimmed past `last_id`"""
+        entries = await self.redis.xrange(self.redis_stream_key, count=1)
+        if not entries or self._parse_id(entries[0][0]) <= self._parse_id(last_id):
+            return
+
+        logger.warning(f"Cache stream trimmed past {last_id!r}, resyncing")
+        self.sync_gaps.inc()
+        if self.replication == "invalidate":
+            # values are fetched lazily anyway, dropping them is the cheapest
+            if self.shared is not None:
+                self.shared.clear()
+            self.cache.clear()
+            self.bytes = 0
+            return
+        await self._resync_local_keys()
+
+    async def _resync_local_keys(self) -> None:
+        """Re-reads every locally cached key from the Redis hash"""
+        keys = self.shared.keys() if self.shared is not None else list(self.cache)
+        for start in range(0, len(keys), self.sync_batch_size):
+            chunk = keys[start : start + self.sync_batch_size]
+            values = await self._fetch_from_redis(chunk)
+            for key, value in zip(chunk, values):
+                if value is None:
+                    self._drop(key)
 
-    def stop(self):
+    @staticmethod
+    def _parse_id(stream_id: bytes) -> tuple[int, int]:
+        ms, _, seq = stream_id.partition(b"-")
+        return int(ms), int(seq or 0)
+
+    @classmethod
+    def _id_time(cls, stream_id: bytes) -> float:
+        return cls._parse_id(stream_id)[0] / 1000
+
+    def _apply_stream_messages(self, messages: list) -> None:
+        now = time.time()
+        for msg_id, fields in messages:
+            op = fields[b"op"].decode()
+            key = fields[b"key"].decode()
+            value = fields.get(b"value")
+            version = int(fields.get(b"version", 0))
+            sender = fields.get(b"sender", b"").decode()
+            if sender == self.instance_id:
+                continue
+            if self.shared is not None and fields.get(b"host") == self._host:
+                # a worker of this host already wrote the shared table
+                continue
+
+            logger.debug(
+                "RECIVE ACTION",
+                extra={
+                    "op": op,
+                    "key": key,
+                    "to": self.instance_id,
+                    "from": sender,
+                },
+            )
+
+            try:
+                if op == "append" and value:
+                    if self._apply_remote_append(key, value, version):
+                        continue
+                    # a copy that missed an append is outdated
+                    self._drop(key)
+                elif version:
+                    entry = self.cache.get(key)
+                    if self.shared is not None or (
+                        entry is not None and entry.version < version
+                    ):
+                        self._drop(key)
+                elif op == "set" and value:
+                    unpacked_value, timestamp = self._decode(value)
+                    if now - timestamp < self.max_age:
+                        self._apply_remote_set(
+                            key, unpacked_value, timestamp, len(value), raw=value
+                        )
+                    else:
+                        self._drop(key)
+                elif op == "delete":
+                    self._drop(key)
+            except Exception as e:
+                logger.error(f"Failed to process stream message: {e}")
+
+    async def stop(self, drain_timeout: float = 5.0):
+        # writes queued before the stop still go to Redis, the worker exits
+        # once `stop_event` is set
+        try:
+            await asyncio.wait_for(self.task_queue.join(), drain_timeout)
+        except TimeoutError:
+            logger.warning(
+                f"Cache stopped with {self.task_queue.qsize()} Redis writes queued"
+            )
         self.stop_event.set()
+        tasks = [
+            self.task_warm_up,
+            self.task_sweep,
+            self.task_sync,
+            self.task_worker,
+            *self._read_tasks,
+        ]
+        for task in tasks:
+            task.cancel()
+        # the tasks use the shared table, it is closed only after they exit
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.shared is not None:
+            self.shared.close()
 
     async def get(self, key: str | int) -> Any | None:
-        async with self.lock:
-            if key in self.cache:
-                value, timestamp = self.cache[key]
-                now = time.time()
-                if now - timestamp < self.max_age:
-                    self.cache.move_to_end(key)
-                    logger.info(
-                        "GET DATA",
-                        extra={
-                            "key": key,
-                            "from": self.instance_id,
-                        },
-                    )
-                    return value
-                else:
-                    del self.cache[key]
-                    await self._delete_item_from_redis(key)
-            return None
+        if self.shared is not None:
+            return await self._get_shared(key)
+
+        entry = self.cache.get(key)
+        if entry is None:
+            return await self._read_through(key)
+
+        if time.time() - entry.timestamp < self.max_age:
+            self.cache.move_to_end(key)
+            return entry.value
+
+        self._drop(key)
+        self.expirations.inc()
+        self._delete_item_from_redis(key)
+        return None
+
+    async def _get_shared(self, key: str | int) -> Any | None:
+        item = self.shared.get(str(key))
+        if item is None:
+            return await self._read_through(key)
+
+        raw, timestamp = item
+        if time.time() - timestamp < self.max_age:
+            return self._decode(raw)[0]
+
+        self._drop(key)
+        self.expirations.inc()
+        self._delete_item_from_redis(key)
+        return None
 
     async def set(self, key: str | int, value: Any) -> None:
-        async with self.lock:
-            if key in self.cache:
-                self.cache.move_to_end(key)
-            self.cache[key] = (value, time.time())
-            if len(self.cache) > self.maxsize:
-                old_key, _ = self.cache.popitem(last=False)
-                await self._delete_item_from_redis(old_key)
-            await self._save_item_to_redis(key, value)
+        timestamp = time.time()
+        dumped = self.value_dump(value) if self.value_dump is not None else value
+        packed_value = self.codec.encode(dumped, timestamp)
+        self._store(key, value, timestamp, len(packed_value), raw=packed_value)
+        if self.list_capacity:
+            packed_items = [self.codec.encode(item, timestamp) for item in dumped]
+            self._save_item_to_redis(key, (packed_value, packed_items))
+        else:
+            self._save_item_to_redis(key, packed_value)
+
+    async def append(self, key: str | int, item: Any) -> bool:
+        """
+        Appends `item` to a cached sequence value. In list mode only the item
+        is sent to Redis and peers, otherwise the whole value is written.
+        Returns False when the value is not cached, the caller has to `set` it.
+        """
+        timestamp = time.time()
+        if self.shared is not None:
+            current = self.shared.get(str(key))
+            if current is None or timestamp - current[1] >= self.max_age:
+                return False
+            value, _ = self._decode(current[0])
+            value.append(item)
+            if not self.list_capacity:
+                await self.set(key, value)
+                return True
+            self.shared.set(str(key), self._encode(value, timestamp), timestamp)
+        else:
+            entry = self.cache.get(key)
+            if entry is None or timestamp - entry.timestamp >= self.max_age:
+                return False
+            if not self.list_capacity:
+                entry.value.append(item)
+                await self.set(key, entry.value)
+                return True
+
+        dumped = self.item_dump(item) if self.item_dump is not None else item
+        packed_item = self.codec.encode(dumped, timestamp)
+        if self.shared is None:
+            self._append_to_entry(key, entry, item, len(packed_item), timestamp)
+        self.appends.inc()
+        self._append_item_to_redis(key, packed_item)
+        return True
@@ -0,0 +1,120 @@
+import struct
+import zlib
+from typing import Any, Literal, Protocol
+
+from src.json import json
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover
+    lz4_frame = None
+
+
+Compression = Literal["none", "zlib", "zstd", "lz4"]
+
+
+class CacheCodec(Protocol):
+    """Converts a cached value and its timestamp to bytes stored in Redis"""
+
+    def encode(self, value: Any, timestamp: float) -> bytes: ...
+
+    def decode(self, raw: bytes) -> tuple[Any, float]: ...
+
+
+class JsonCodec:
+    """Legacy format: `[value, timestamp]` as JSON text"""
+
+    def encode(self, value: Any, timestamp: float) -> bytes:
+        return json.dumpb([value, timestamp])
+
+    def decode(self, raw: bytes) -> tuple[Any, float]:
+        value, timestamp = json.loads(raw)
+        return value, timestamp
+
+
+class BinaryCodec:
+    """
+    Versioned binary format.
+
+    Layout: version (1 byte), compression id (1 byte), timestamp (float64),
+    then the orjson encoded value, compressed when it is larger than
+    `compress_threshold` bytes. Values in the legacy JSON format are still
+    decoded, so pods can be upgraded one by one.
+    """
+
+    VERSION = 1
+    HEADER = struct.Struct("<BBd")
+    COMPRESSION_IDS: dict[Compression, int] = {
+        "none": 0,
+        "zlib": 1,
+        "zstd": 2,
+        "lz4": 3,
+    }
+
+    def __init__(
+        self, compression: Compression = "zlib", compress_threshold: int = 1024
+    ):
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression requires the `zstandard` package")
+        if compression == "lz4" and lz4_frame is None:
+            raise ImportError("lz4 compression requires the `lz4` package")
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self._legacy = JsonCodec()
+        if zstandard is not None:
+            self._zstd_compressor = zstandard.ZstdCompressor(level=3)
+            self._zstd_decompressor = zstandard.ZstdDecompressor()
+
+    def encode(self, value: Any, timestamp: float) -> bytes:
+        payload = json.dumpb(value)
+        compression: Compression = "none"
+        if self.compression != "none" and len(payload) > self.compress_threshold:
+            payload = self._compress(payload)
+            compression = self.compression
+        header = self.HEADER.pack(
+            self.VERSION, self.COMPRESSION_IDS[compression], timestamp
+        )
+        return header + payload
+
+    def decode(self, raw: bytes) -> tuple[Any, float]:
+        if raw[:1] == b"[":
+            return self._legacy.decode(raw)
+
+        version, compression_id, timestamp = self.HEADER.unpack_from(raw)
+        if version != self.VERSION:
+            raise ValueError(f"Unsupported cache codec version {version}")
+        payload = memoryview(raw)[self.HEADER.size :]
+        if compression_id:
+            payload = self._decompress(compression_id, payload)
+        return json.loads(payload), timestamp
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self.compression == "zstd":
+            return self._zstd_compressor.compress(payload)
+        if self.compression == "lz4":
+            return lz4_frame.compress(payload)
+        return zlib.compress(payload, 6)
+
+    def _decompress(self, compression_id: int, payload: memoryview) -> bytes:
+        if compression_id == self.COMPRESSION_IDS["zlib"]:
+            return zlib.decompress(payload)
+        if compression_id == self.COMPRESSION_IDS["zstd"] and zstandard is not None:
+            return self._zstd_decompressor.decompress(payload)
+        if compression_id == self.COMPRESSION_IDS["lz4"] and lz4_frame is not None:
+            return lz4_frame.decompress(payload)
+        raise ValueError(f"Unsupported cache compression id {compression_id}")
+
+
+def get_codec(
+    name: Literal["json", "binary"],
+    compression: Compression = "zlib",
+    compress_threshold: int = 1024,
+) -> CacheCodec:
+    if name == "json":
+        return JsonCodec()
+    return BinaryCodec(compression=compression, compress_threshold=compress_threshold)
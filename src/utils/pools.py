@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+from redis.asyncio import BlockingConnectionPool
+from redis.exceptions import ConnectionError
+
+from config.config import settings
+from src.utils.metrics import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def budget_share(budget: int, pools: int = 1) -> int:
+    """Connections of one pool when `pools` pools of every worker share `budget`"""
+    return max(1, budget // (max(1, settings.WEB_CONCURRENCY) * pools))
+
+
+def db_pool_limits(pool_size: int, max_overflow: int) -> tuple[int, int]:
+    """
+    Pool size and overflow of an engine. In budget mode every worker keeps
+    its share of `DB_CONNECTION_BUDGET` without overflow, so the workers
+    together never open more connections than the budget.
+    """
+    if settings.POOL_SIZING == "fixed":
+        return pool_size, max_overflow
+    return budget_share(settings.DB_CONNECTION_BUDGET), 0
+
+
+def redis_max_connections() -> int:
+    if settings.POOL_SIZING == "fixed":
+        return settings.REDIS_MAX_CONNECTIONS
+    # the history cache and the optional intent and search cache tiers
+    pools = 1 + settings.INTENT_CACHE_REDIS + settings.SEARCH_CACHE_REDIS
+    return budget_share(settings.REDIS_CONNECTION_BUDGET, pools)
+
+
+class InstrumentedRedisPool(BlockingConnectionPool):
+    """
+    Redis pool that waits up to `timeout` seconds for a free connection
+    instead of failing at once and reports the wait, the timeouts and the
+    connections in use as `redis_{name}_pool_*` metrics.
+    """
+
+    def __init__(self, *args, name: str = "redis", **kwargs):
+        super().__init__(*args, **kwargs)
+        prefix = f"redis_{name}_pool"
+        self.wait = metrics.histogram(
+            f"{prefix}_wait_seconds", "Time to get a Redis connection"
+        )
+        self.timeouts = metrics.counter(
+            f"{prefix}_timeouts", "No free Redis connection within the timeout"
+        )
+        metrics.gauge(
+            f"{prefix}_in_use",
+            "Redis connections in use",
+            func=lambda: len(self._in_use_connections),
+        )
+        metrics.gauge(
+            f"{prefix}_idle",
+            "Open Redis connections waiting in the pool",
+            func=lambda: len(self._available_connections),
+        )
+
+    async def get_connection(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().get_connection(*args, **kwargs)
+        except ConnectionError as e:
+            if isinstance(e.__cause__, asyncio.TimeoutError):
+                self.timeouts.inc()
+            raise
+        finally:
+            self.wait.observe(time.perf_counter() - started)
+
+
+def redis_pool(
+    name: str, timeout: float = settings.REDIS_POOL_TIMEOUT, **kwargs
+) -> InstrumentedRedisPool:
+    max_connections = redis_max_connections()
+    logger.info(f"Redis pool {name}: {max_connections} connections")
+    return InstrumentedRedisPool.from_url(
+        url=settings.REDIS_URL,
+        name=name,
+        max_connections=max_connections,
+        timeout=timeout,
+        **kwargs,
+    )
@@ -0,0 +1,273 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from src.utils.metrics import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SharedMemoryTable:
+    """
+    Fixed size hash table in a memory mapped file, shared by all workers
+    of one host (the file is expected to live in `/dev/shm`).
+
+    Every slot holds one key and its encoded value. Collisions are resolved
+    by linear probing inside a window of `probe` slots; when the window is
+    full the least recently accessed slot of it is replaced. Values that do
+    not fit in a slot are not stored and are counted as oversized.
+
+    Access is serialized between processes with `flock`: shared for reads,
+    exclusive for writes. One worker per host can hold the syncer lock.
+    """
+
+    MAGIC = b"EBSHM001"
+    # magic, slots, slot size, last applied stream id
+    FILE_HEADER = struct.Struct("<8sII32s")
+    # key hash, value timestamp, last access, key length, value length
+    SLOT_HEADER = struct.Struct("<QddII")
+
+    def __init__(self, path: str, slots: int, slot_size: int, probe: int = 8):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.probe = min(probe, slots)
+        self.size = self.FILE_HEADER.size + slots * slot_size
+        self._syncer_fd: int | None = None
+        self.oversized = metrics.counter(
+            "cache_shared_oversized", "Values too large for a shared memory slot"
+        )
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            with self._locked(fcntl.LOCK_EX):
+                if not self._layout_matches():
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, self.size)
+                    os.pwrite(
+                        self._fd,
+                        self.FILE_HEADER.pack(self.MAGIC, slots, slot_size, b""),
+                        0,
+                    )
+                self._reserve()
+        except Exception:
+            os.close(self._fd)
+            raise
+        self._mm = mmap.mmap(self._fd, self.size)
+
+    def _reserve(self) -> None:
+        """
+        Allocates every page of the file up front. A sparse file larger than
+        the free space of `/dev/shm` maps fine, but a worker touching a page
+        that can not be allocated later dies with SIGBUS.
+        """
+        try:
+            os.posix_fallocate(self._fd, 0, self.size)
+        except OSError as e:
+            # no worker maps a file that does not fit, the next start recreates it
+            os.ftruncate(self._fd, 0)
+            free = os.statvfs(os.path.dirname(self.path) or ".")
+            raise RuntimeError(
+                f"Can not allocate {self.size} bytes for the shared memory cache "
+                f"{self.path}, {free.f_bavail * free.f_frsize} bytes are free: {e}. "
+                "Lower CACHE_MAX_BYTES or CACHE_SHARED_SLOTS, or raise the shm "
+                "size of the container"
+            ) from e
+
+    def _layout_matches(self) -> bool:
+        if os.fstat(self._fd).st_size != self.size:
+            return False
+        raw = os.pread(self._fd, self.FILE_HEADER.size, 0)
+        magic, slots, slot_size, _ = self.FILE_HEADER.unpack(raw)
+        return (magic, slots, slot_size) == (self.MAGIC, self.slots, self.slot_size)
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        fcntl.flock(self._fd, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key: bytes) -> int:
+        # python `hash` is randomized per process, it can not be shared
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        return int.from_bytes(digest, "little") | 1
+
+    def _offset(self, index: int) -> int:
+        return self.FILE_HEADER.size + index * self.slot_size
+
+    def _window(self, key_hash: int) -> Iterator[int]:
+        start = key_hash % self.slots
+        for i in range(self.probe):
+            yield (start + i) % self.slots
+
+    def _find(self, key_hash: int, key: bytes) -> int | None:
+        for index in self._window(key_hash):
+            offset = self._offset(index)
+            slot_hash, _, _, key_len, _ = self.SLOT_HEADER.unpack_from(self._mm, offset)
+            if slot_hash != key_hash:
+                continue
+            start = offset + self.SLOT_HEADER.size
+            if self._mm[start : start + key_len] == key:
+                return index
+        return None
+
+    def _victim(self, key_hash: int) -> int:
+        victim, oldest_access = 0, float("inf")
+        for index in self._window(key_hash):
+            slot_hash, _, last_access, _, _ = self.SLOT_HEADER.unpack_from(
+                self._mm, self._offset(index)
+            )
+            if slot_hash == 0:
+                return index
+            if last_access < oldest_access:
+                victim, oldest_access = index, last_access
+        return victim
+
+    def get(self, key: str) -> tuple[bytes, float] | None:
+        key_bytes = key.encode()
+        key_hash = self._hash(key_bytes)
+        with self._locked(fcntl.LOCK_SH):
+            index = self._find(key_hash, key_bytes)
+            if index is None:
+                return None
+            offset = self._offset(index)
+            _, timestamp, _, key_len, value_len = self.SLOT_HEADER.unpack_from(
+                self._mm, offset
+            )
+            start = offset + self.SLOT_HEADER.size + key_len
+            raw = self._mm[start : start + value_len]
+            # last access is only a hint for eviction, a racy write is fine
+            struct.pack_into("<d", self._mm, offset + 16, time.time())
+        return raw, timestamp
+
+    def set(
+        self, key: str, raw: bytes, timestamp: float, if_newer: bool = False
+    ) -> bool:
+        key_bytes = key.encode()
+        size = self.SLOT_HEADER.size + len(key_bytes) + len(raw)
+        if size > self.slot_size:
+            if not self.oversized.value:
+                logger.warning(
+                    f"Cache value of {size} bytes does not fit in a shared memory "
+                    f"slot of {self.slot_size}, raise CACHE_SHARED_SLOT_SIZE"
+                )
+            self.oversized.inc()
+            # an older copy would be served instead of the new value
+            self.delete(key)
+            return False
+
+        key_hash = self._hash(key_bytes)
+        with self._locked(fcntl.LOCK_EX):
+            index = self._find(key_hash, key_bytes)
+            if index is None:
+                index = self._victim(key_hash)
+            elif if_newer:
+                _, current, _, _, _ = self.SLOT_HEADER.unpack_from(
+                    self._mm, self._offset(index)
+                )
+                if current >= timestamp:
+                    return False
+
+            offset = self._offset(index)
+            self.SLOT_HEADER.pack_into(
+                self._mm,
+                offset,
+                key_hash,
+                timestamp,
+                time.time(),
+                len(key_bytes),
+                len(raw),
+            )
+            start = offset + self.SLOT_HEADER.size
+            self._mm[start : start + len(key_bytes) + len(raw)] = key_bytes + raw
+        return True
+
+    def delete(self, key: str) -> None:
+        key_bytes = key.encode()
+        key_hash = self._hash(key_bytes)
+        with self._locked(fcntl.LOCK_EX):
+            index = self._find(key_hash, key_bytes)
+            if index is not None:
+                self.SLOT_HEADER.pack_into(self._mm, self._offset(index), 0, 0, 0, 0, 0)
+
+    def expire(self, older_than: float) -> int:
+        """Frees slots with values written before `older_than`"""
+        expired = 0
+        with self._locked(fcntl.LOCK_EX):
+            for index in range(self.slots):
+                offset = self._offset(index)
+                slot_hash, timestamp, _, _, _ = self.SLOT_HEADER.unpack_from(
+                    self._mm, offset
+                )
+                if slot_hash and timestamp < older_than:
+                    self.SLOT_HEADER.pack_into(self._mm, offset, 0, 0, 0, 0, 0)
+                    expired += 1
+        return expired
+
+    def keys(self) -> list[str]:
+        keys = []
+        with self._locked(fcntl.LOCK_SH):
+            for index in range(self.slots):
+                offset = self._offset(index)
+                slot_hash, _, _, key_len, _ = self.SLOT_HEADER.unpack_from(
+                    self._mm, offset
+                )
+                if slot_hash:
+                    start = offset + self.SLOT_HEADER.size
+                    keys.append(self._mm[start : start + key_len].decode())
+        return keys
+
+    def used(self) -> int:
+        with self._locked(fcntl.LOCK_SH):
+            return sum(
+                1
+                for index in range(self.slots)
+                if struct.unpack_from("<Q", self._mm, self._offset(index))[0]
+            )
+
+    def clear(self) -> None:
+        with self._locked(fcntl.LOCK_EX):
+            for index in range(self.slots):
+                self.SLOT_HEADER.pack_into(self._mm, self._offset(index), 0, 0, 0, 0, 0)
+
+    @property
+    def last_stream_id(self) -> bytes | None:
+        _, _, _, stream_id = self.FILE_HEADER.unpack_from(self._mm, 0)
+        return stream_id.rstrip(b"\0") or None
+
+    @last_stream_id.setter
+    def last_stream_id(self, stream_id: bytes) -> None:
+        struct.pack_into("<32s", self._mm, 16, stream_id)
+
+    def try_become_syncer(self) -> bool:
+        """Takes the host wide syncer lock, it is released when the process exits"""
+        if self._syncer_fd is not None:
+            return True
+        fd = os.open(f"{self.path}.syncer", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._syncer_fd = fd
+        return True
+
+    @property
+    def is_syncer(self) -> bool:
+        return self._syncer_fd is not None
+
+    def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+        if self._syncer_fd is not None:
+            os.close(self._syncer_fd)
+            self._syncer_fd = None
@@ -0,0 +1,43 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import TypeVar
+
+from src.utils.metrics import metrics
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight call.
+
+    All callers get the result (or the error) of the first call. A cancelled
+    caller does not cancel the shared call for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self.calls = metrics.counter(f"single_flight_{name}_calls", f"Calls to {name}")
+        self.deduplicated = metrics.counter(
+            f"single_flight_{name}_deduplicated",
+            f"Calls to {name} served by an in-flight call",
+        )
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        self.calls.inc()
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        else:
+            self.deduplicated.inc()
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # mark the error as retrieved when every waiter has been cancelled
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,15 @@
+import os
+
+# required settings, the tests do not connect anywhere
+for name, value in {
+    "OPENAI_API_KEY": "test",
+    "INTENT_API_URL": "http://intent",
+    "QUERY_API_URL": "http://query",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_DB": "test",
+    "POSTGRES_USER": "test",
+    "POSTGRES_PASSWORD": "test",
+    "REDIS_URL": "redis://localhost:6379",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,29 @@
+import asyncio
+
+from src.utils.cache import SafeLRUCache
+from src.utils.singleton import SingletonMeta
+
+
+def test_stop_flushes_queued_writes():
+    flushed = []
+
+    async def flush_ops(batch):
+        await asyncio.sleep(0.05)
+        flushed.extend(batch)
+
+    async def run():
+        SingletonMeta._instances.pop(SafeLRUCache, None)
+        cache = SafeLRUCache(max_age=60, maxsize=10, warmup_keys=0)
+        cache._flush_ops = flush_ops
+        try:
+            for i in range(3):
+                await cache.set(f"user-{i}", [i])
+            await cache.stop()
+        finally:
+            SingletonMeta._instances.pop(SafeLRUCache, None)
+        return cache
+
+    cache = asyncio.run(run())
+
+    assert [key for _, key, _ in flushed] == ["user-0", "user-1", "user-2"]
+    assert cache.task_queue.empty()
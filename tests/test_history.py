@@ -0,0 +1,86 @@
+import asyncio
+from datetime import UTC, datetime
+
+import pytest
+
+from config.config import settings
+from src.schema.history import ChatItem
+from src.service import history
+from src.service.history import UserHistory
+from src.utils.singleton import SingletonMeta
+
+
+class FakeCache:
+    async def get(self, key):
+        return None
+
+    async def set(self, key, value):
+        raise AssertionError("pages beyond the buffer must not be cached")
+
+
+@pytest.fixture
+def user_history(monkeypatch):
+    calls = []
+
+    async def run_read(query):
+        return await query(None)
+
+    async def paginated(session, user_id, limit, offset):
+        calls.append(("offset", limit, offset))
+        return [
+            ChatItem(user="q", assistant="a", assistant_send_at=datetime.now(UTC))
+        ] * limit
+
+    async def before(session, user_id, limit, before):
+        calls.append(("keyset", limit, before))
+        return [], None
+
+    async def rows(session, user_id, limit, since):
+        calls.append(("rows", limit, since is not None))
+        return []
+
+    monkeypatch.setattr(history, "run_read", run_read)
+    monkeypatch.setattr(history, "get_user_history_rows", rows)
+    monkeypatch.setattr(history, "get_user_messages_paginated", paginated)
+    monkeypatch.setattr(history, "get_user_messages_before", before)
+    SingletonMeta._instances.pop(UserHistory, None)
+    yield UserHistory(cache=FakeCache()), calls
+    SingletonMeta._instances.pop(UserHistory, None)
+
+
+def test_offset_paging_beyond_buffer_size(user_history):
+    user_history, calls = user_history
+    limit = settings.HISTORY_BUFFER_SIZE * 2
+
+    page = asyncio.run(user_history.get(user_id="1", limit=limit, offset=limit))
+
+    assert calls == [("offset", limit, limit)]
+    assert len(page.data) == limit
+
+
+def test_first_page_beyond_buffer_size_uses_keyset(user_history):
+    user_history, calls = user_history
+    limit = settings.HISTORY_BUFFER_SIZE * 2
+
+    asyncio.run(user_history.get(user_id="1", limit=limit))
+
+    assert calls == [("keyset", limit, None)]
+
+
+def test_first_page_falls_back_to_keyset_past_recent_days(user_history, monkeypatch):
+    user_history, calls = user_history
+    monkeypatch.setattr(settings, "HISTORY_RECENT_DAYS", 7)
+
+    asyncio.run(user_history.get(user_id="1", limit=10))
+
+    assert calls == [("rows", 10, True), ("keyset", 10, None)]
+
+
+def test_short_first_page_without_recent_days(user_history, monkeypatch):
+    user_history, calls = user_history
+    monkeypatch.setattr(settings, "HISTORY_RECENT_DAYS", None)
+
+    page = asyncio.run(user_history.get(user_id="1", limit=10))
+
+    assert calls == [("rows", 10, False)]
+    assert page.next_cursor is None
@@ -0,0 +1,26 @@
+import asyncio
+from datetime import UTC, datetime
+
+from src.repo.history_queue import MessageHistoryQueue
+from src.utils.singleton import SingletonMeta
+
+
+def test_drop_oldest_keeps_newest_rows():
+    async def run():
+        SingletonMeta._instances.pop(MessageHistoryQueue, None)
+        queue = MessageHistoryQueue(
+            flush_interval=60, flush_size=100, capacity=2, overflow="drop_oldest"
+        )
+        try:
+            for text in ("first", "second", "third"):
+                await queue.add(1, text, "answer", datetime.now(UTC))
+            kept = [row["user_text"] for row in queue._buffer]
+            queue.task.cancel()
+        finally:
+            SingletonMeta._instances.pop(MessageHistoryQueue, None)
+        return kept, queue.dropped.value
+
+    kept, dropped = asyncio.run(run())
+
+    assert kept == ["second", "third"]
+    assert dropped == 1